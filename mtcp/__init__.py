@@ -0,0 +1,6 @@
+"""
+MTCP: Modbus TCP data logger for PLC traceability, error code and downtime registers.
+
+The monitoring engines, configuration loading and sinks in this package need no GUI;
+run them headless with `python -m mtcp`, or through the optional Tk front-end.
+"""
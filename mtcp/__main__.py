@@ -0,0 +1,3 @@
+from mtcp.cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,341 @@
+"""
+Columnar archive of register snapshots in Arrow IPC files (requires the optional `pyarrow` package).
+
+Each output gets one file per day, `{file_name}_{date}.arrow`, with typed timestamp and metadata
+columns, the register block as a fixed-size list of uint16, the sample number and trigger value of
+trigger window samples (null for other rows) and one typed column per decoded tag of the output
+(see mtcp.tags). Files are read back memory-mapped,
+so the register columns can be used without copying:
+
+    table = load_archive("/data/trace", "trace", "2024-05-01", "2024-05-31")
+    for timestamps, registers in iter_register_blocks(table):
+        ...  # registers is a (rows, range) uint16 NumPy view
+
+Existing CSV archives are converted with `python -m mtcp.archive SRC_DIR DEST_DIR`.
+"""
+import argparse
+import csv
+import glob
+import os
+import re
+import time
+from array import array
+
+try:
+    import pyarrow as pa
+except ImportError:  # Optional dependency, only needed for the archive sink
+    pa = None
+
+from mtcp.sinks import SINK_FLUSH_INTERVAL, QueuedSink, csv_headers
+
+# Rows buffered per file before a record batch is written regardless of the flush interval
+ARCHIVE_BATCH_ROWS = 10000
+
+ARCHIVE_FILE_PATTERN = re.compile(r"^(?P<file_name>.+)_(?P<date>\d{4}-\d{2}-\d{2})(\.\d+)?\.arrow$")
+CSV_FILE_PATTERN = re.compile(r"^(?P<file_name>.+)_(?P<date>\d{4}-\d{2}-\d{2})\.csv$")
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The columnar archive needs the 'pyarrow' package: pip install pyarrow")
+
+
+def tag_field_type(tag):
+    """Arrow type of the column of a decoded tag; scaled numbers become float64."""
+    tag_type = tag.get("type", "UINT16")
+    if tag_type == "STRING":
+        return pa.string()
+    if tag_type == "BOOL":
+        return pa.bool_()
+    scale = tag.get("scale")
+    if tag_type == "FLOAT64" or (scale is not None and float(scale) != 1.0):
+        return pa.float64()
+    return {
+        "INT16": pa.int16(),
+        "UINT16": pa.uint16(),
+        "INT32": pa.int32(),
+        "UINT32": pa.uint32(),
+        "INT64": pa.int64(),
+        "UINT64": pa.uint64(),
+        "FLOAT32": pa.float32(),
+    }[tag_type]
+
+
+def tag_fields(output):
+    """(name, Arrow type) of the tag columns of an output."""
+    return tuple((tag["name"], tag_field_type(tag)) for tag in output.get("tags", []))
+
+
+def window_fields():
+    """(name, Arrow type) of the columns of trigger window samples, which are null for other rows."""
+    return (("sample", pa.int32()), ("trigger", pa.int32()))
+
+
+def archive_schema(register_count, tags=()):
+    """Schema of an archive file whose snapshots hold `register_count` registers and the tag columns `tags`."""
+    return pa.schema([
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("line_name", pa.dictionary(pa.int32(), pa.string())),
+        ("equipment_name", pa.dictionary(pa.int32(), pa.string())),
+        ("ip_address", pa.dictionary(pa.int32(), pa.string())),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("registers", pa.list_(pa.uint16(), register_count)),
+    ] + list(window_fields()) + list(tags))
+
+
+class ArchiveFile:
+    """An open Arrow IPC stream of one output and day, with the rows not written yet."""
+
+    def __init__(self, path, register_count, tags=()):
+        self.path = path
+        self.register_count = register_count
+        self.tags = tags
+        self.schema = archive_schema(register_count, tags)
+        self.stream = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.stream, self.schema)
+        self.rows = []
+
+    def write_rows(self):
+        """Write the buffered rows as one record batch."""
+        if not self.rows:
+            return
+        (timestamps, line_names, equipment_names, ip_addresses, categories, registers,
+         samples, trigger_values, tag_values) = zip(*self.rows)
+        # Concatenate the register arrays and hand the buffer to Arrow without boxing the values
+        flat_registers = array("H")
+        for block in registers:
+            if block.typecode != "H":  # Coil and discrete input bits
+                block = array("H", block)
+            flat_registers.extend(block)
+        register_values = pa.Array.from_buffers(pa.uint16(), len(flat_registers), [None, pa.py_buffer(flat_registers)])
+        batch = pa.record_batch([
+            pa.array([int(timestamp * 1_000_000) for timestamp in timestamps], pa.timestamp("us", tz="UTC")),
+            pa.array(line_names, pa.string()).dictionary_encode(),
+            pa.array(equipment_names, pa.string()).dictionary_encode(),
+            pa.array(ip_addresses, pa.string()).dictionary_encode(),
+            pa.array(categories, pa.string()).dictionary_encode(),
+            pa.FixedSizeListArray.from_arrays(register_values, self.register_count),
+            pa.array(samples, pa.int32()),
+            pa.array(trigger_values, pa.int32()),
+        ] + [pa.array(values, field_type)
+             for values, (_, field_type) in zip(zip(*tag_values), self.tags)], schema=self.schema)
+        self.writer.write_batch(batch)
+        self.rows = []
+
+    def close(self):
+        self.write_rows()
+        self.writer.close()
+        self.stream.close()
+
+
+def archive_path(folder, file_name, file_date):
+    """Return a path for a new archive file; a file left by an earlier run gets a numbered sibling."""
+    path = os.path.join(folder, f"{file_name}_{file_date}.arrow")
+    part = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{file_name}_{file_date}.{part}.arrow")
+        part += 1
+    return path
+
+
+class ArchiveSink(QueuedSink):
+    """
+    Write captured snapshots into daily Arrow IPC files next to the CSV files of each output.
+    Rows are buffered per file and written as one record batch per flush.
+    """
+
+    name = "archive"
+
+    def __init__(self, log=print, flush_interval=SINK_FLUSH_INTERVAL, latency=None, spool_dir=None):
+        require_pyarrow()
+        self.files = {}  # (folder, file name) -> ArchiveFile of the current date
+        self.file_date = None
+        self.next_midnight = 0.0
+        super().__init__(log, flush_interval, latency, spool_dir)
+
+    def roll_date(self, timestamp):
+        """Close the files of the previous day when `timestamp` passes midnight."""
+        if timestamp >= self.next_midnight:
+            day = time.localtime(timestamp)
+            self.file_date = time.strftime("%Y-%m-%d", day)
+            self.next_midnight = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+            self.release()
+
+    def open_file(self, output_folder, file_name, register_count, tags=()):
+        key = (output_folder, file_name)
+        archive_file = self.files.get(key)
+        if archive_file is not None and (archive_file.register_count != register_count or archive_file.tags != tags):
+            # The register range or the tags of the output changed: continue in a new file
+            self.close_file(key)
+            archive_file = None
+        if archive_file is None:
+            if not os.path.exists(output_folder):
+                os.makedirs(output_folder)
+            archive_file = ArchiveFile(archive_path(output_folder, file_name, self.file_date),
+                                       register_count, tags)
+            self.files[key] = archive_file
+        return archive_file
+
+    def write_batch(self, batch):
+        written = []
+        for capture in batch:
+            output, plc, category = capture.output, capture.plc, capture.category
+            output_folder = output.get("folder_path", "")
+            file_name = output.get("file_name", "")
+            if not output_folder or not file_name:
+                continue
+
+            self.roll_date(capture.capture_time)
+            try:
+                tags = tag_fields(output) if capture.tag_values is not None else ()
+                archive_file = self.open_file(output_folder, file_name, len(capture.registers), tags)
+                sample, trigger_value = capture.window if capture.window is not None else (None, None)
+                if trigger_value is not None:
+                    trigger_value = int(trigger_value)  # A coil or discrete input trigger is a bool
+                archive_file.rows.append((capture.capture_time, plc["line_name"], plc["equipment_name"],
+                                          plc["ip_address"], category, capture.registers, sample, trigger_value,
+                                          capture.tag_values or ()))
+                if len(archive_file.rows) >= ARCHIVE_BATCH_ROWS:
+                    archive_file.write_rows()
+                written.append(capture)
+            except Exception as e:
+                self.log(f"Error archiving data of PLC '{plc['line_name']}' in category '{category}': {e}")
+                self.close_file((output_folder, file_name))
+                self.failed.append(capture)
+        return written
+
+    def flush(self):
+        flushed = True
+        for key, archive_file in list(self.files.items()):
+            try:
+                archive_file.write_rows()
+            except Exception as e:
+                self.log(f"Error writing {archive_file.path}: {e}")
+                self.close_file(key)
+                flushed = False
+        return flushed
+
+    def close_file(self, key):
+        archive_file = self.files.pop(key, None)
+        if archive_file is not None:
+            try:
+                archive_file.close()
+            except Exception as e:
+                self.log(f"Error closing {archive_file.path}: {e}")
+
+    def release(self):
+        for key in list(self.files):
+            self.close_file(key)
+
+
+def read_archive_file(path):
+    """Read one archive file memory-mapped; the returned table references the file without copying."""
+    require_pyarrow()
+    return with_window_fields(pa.ipc.open_stream(pa.memory_map(path, "r")).read_all())
+
+
+def with_window_fields(table):
+    """Add the null window columns to a table read from a file written before the archive had them."""
+    index = table.schema.get_field_index("registers")
+    for name, field_type in window_fields():
+        index += 1
+        if table.schema.get_field_index(name) < 0:
+            table = table.add_column(index, pa.field(name, field_type), pa.nulls(len(table), field_type))
+    return table
+
+
+def load_archive(folder, file_name, start_date=None, end_date=None):
+    """
+    Load the archive files of one output, optionally limited to dates between `start_date` and
+    `end_date` (inclusive, "YYYY-MM-DD"), as one table.
+    """
+    require_pyarrow()
+    tables = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(folder), f"{glob.escape(file_name)}_*.arrow"))):
+        match = ARCHIVE_FILE_PATTERN.match(os.path.basename(path))
+        if not match or match.group("file_name") != file_name:
+            continue
+        file_date = match.group("date")
+        if (start_date and file_date < start_date) or (end_date and file_date > end_date):
+            continue
+        tables.append(read_archive_file(path))
+    if not tables:
+        return None
+    if any(not table.schema.equals(tables[0].schema) for table in tables[1:]):
+        # Files written with different register ranges or tags cannot be concatenated
+        raise ValueError(f"Archive files of '{file_name}' have different register ranges or tags.")
+    return pa.concat_tables(tables)
+
+
+def iter_register_blocks(table):
+    """
+    Yield (timestamps, registers) per chunk of an archive table, where `registers` is a
+    (rows, register count) uint16 NumPy view on the memory-mapped data.
+    """
+    register_count = table.schema.field("registers").type.list_size
+    timestamps = table.column("timestamp").chunks
+    for timestamp_chunk, register_chunk in zip(timestamps, table.column("registers").chunks):
+        values = register_chunk.flatten().to_numpy(zero_copy_only=True)
+        yield timestamp_chunk, values.reshape(-1, register_count)
+
+
+def convert_csv_file(csv_path, destination):
+    """
+    Convert one daily CSV file written by CsvSink into an archive file; returns the number of rows,
+    or None for a file of decoded tags or trigger window samples, which has other columns.
+    """
+    rows = []
+    with open(csv_path, newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        headers = next(reader, None)
+        if headers is None:
+            return 0
+        register_count = len(headers) - 4
+        if headers != csv_headers(register_count):
+            return None
+        for values in reader:
+            if len(values) != len(headers):
+                continue
+            line_name, equipment_name, ip_address, timestamp_text = values[:4]
+            timestamp = time.mktime(time.strptime(timestamp_text, "%Y-%m-%d %H:%M:%S"))
+            registers = array("H", [int(value == "True") if value in ("True", "False") else int(value)
+                                    for value in values[4:]])
+            rows.append((timestamp, line_name, equipment_name, ip_address, "", registers, None, None, ()))
+
+    archive_file = ArchiveFile(destination, register_count)
+    archive_file.rows = rows
+    archive_file.close()
+    return len(rows)
+
+
+def convert_csv_archive(source_folder, destination_folder, log=print):
+    """Convert every daily CSV file in `source_folder` that has no archive file yet."""
+    require_pyarrow()
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+    for csv_path in sorted(glob.glob(os.path.join(glob.escape(source_folder), "*.csv"))):
+        match = CSV_FILE_PATTERN.match(os.path.basename(csv_path))
+        if not match:
+            continue
+        destination = os.path.join(destination_folder, f"{match.group('file_name')}_{match.group('date')}.arrow")
+        if os.path.exists(destination):
+            continue
+        row_count = convert_csv_file(csv_path, destination)
+        if row_count is None:
+            log(f"Skipped {csv_path}: it holds decoded tags or trigger window samples.")
+            continue
+        log(f"Converted {row_count} row(s) from {csv_path} to {destination}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mtcp.archive",
+                                     description="Convert daily CSV files into columnar archive files.")
+    parser.add_argument("source", help="folder holding the {file_name}_{date}.csv files")
+    parser.add_argument("destination", help="folder for the {file_name}_{date}.arrow files")
+    args = parser.parse_args(argv)
+    convert_csv_archive(args.source, args.destination)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,232 @@
+"""
+asyncio monitoring engine built on pymodbus's AsyncModbusTcpClient.
+"""
+import asyncio
+import threading
+import time
+
+from mtcp.engine import STOP_TIMEOUT, MonitoringEngine
+from mtcp.modbus import AsyncPLCSession
+from mtcp.schedule import PollScheduler
+
+
+class AsyncEngine(MonitoringEngine):
+    """
+    Same trigger/dedup semantics and read plan as ThreadedEngine, but every PLC is polled
+    by a coroutine on one event loop instead of a thread.
+    The reads of one cycle are issued concurrently over the PLC's single AsyncModbusTcpClient connection,
+    which units behind the same gateway share.
+    """
+
+    session_class = AsyncPLCSession
+
+    def __init__(self, plc_configs, outputs, sink, log=print, latency=None):
+        super().__init__(plc_configs, outputs, sink, log, latency)
+        self.thread = None
+        self.loop = None
+        self.wakeup = None  # Set when the pollers change or a stop is requested
+
+    async def read_block(self, session, block, slots):
+        if slots is None:
+            return await session.read(block.register_type, block.start, block.count)
+        async with slots:
+            return await session.read(block.register_type, block.start, block.count)
+
+    async def read_blocks(self, session, blocks, results, budget=None):
+        """Read `blocks` concurrently, at most `max_in_flight` of them at a time under a request budget."""
+        blocks = [block for block in blocks if block not in results]
+        slots = budget.slots if budget is not None else None
+        values = await asyncio.gather(*(self.read_block(session, block, slots) for block in blocks))
+        results.update(zip(blocks, values))
+
+    def create_budget(self, plc, plan, now):
+        budget = super().create_budget(plc, plan, now)
+        if budget is not None and budget.max_in_flight is not None:
+            budget.slots = asyncio.Semaphore(budget.max_in_flight)
+        return budget
+
+    async def poll_cycle(self, session, plc, plan, scheduler, states, budget=None):
+        """Run one poll cycle for the due outputs of a single PLC, within its request budget."""
+        results = {}
+        paid = set()
+        states = self.admit(plc, budget, plan, scheduler, states, paid, time.monotonic())
+        await self.read_blocks(session, plan.trigger_blocks(states), results, budget)
+        trigger_ns = time.monotonic_ns()
+        capture_time = time.time()
+        fired = self.collect_triggers(plc, plan, states, results)
+
+        if fired:
+            self.spend_data(budget, plan, fired, paid)
+            await self.read_blocks(session, plan.data_blocks(fired), results, budget)
+            for capture in self.collect_data(plc, plan, fired, results, capture_time, trigger_ns):
+                self.emit(capture)
+
+        for state in self.acknowledgements(states):
+            if await session.write(state.ack_type, state.ack_register, state.ack_pending):
+                state.acknowledged(state.ack_pending)
+            else:
+                self.acknowledge_failed(plc, state)
+
+        self.report_read_failures(plc, plan, scheduler, states, results)
+
+    async def process_registers(self, poller):
+        """
+        Continuously monitor every output configuration of a single PLC over one shared connection,
+        until the poller's task is cancelled.
+        A lost connection is re-established with backoff; the trigger and dedup state of the outputs is kept.
+        """
+        plc, outputs = poller.plc, poller.outputs
+        plan = self.build_plan(plc, outputs)
+        scheduler = PollScheduler(plan.states, time.monotonic())
+        breaker = self.create_breaker(plc)
+        budget = self.create_budget(plc, plan, time.monotonic())
+        session = self.open_session(plc)
+        try:
+            while plan.states:
+                try:
+                    if not await session.connect():
+                        raise ConnectionError("connection failed")
+                    scheduler.resume(time.monotonic())
+                    while plan.states:
+                        if poller.outputs is not outputs:
+                            # Configuration reloaded: keep the connection, rebuild the plan
+                            outputs = poller.outputs
+                            plan = self.build_plan(plc, outputs, plan.states)
+                            scheduler = PollScheduler(plan.states, time.monotonic())
+                            budget = self.create_budget(plc, plan, time.monotonic())
+                            continue
+                        delay = scheduler.next_deadline() - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        now = time.monotonic()
+                        await self.poll_cycle(session, plc, plan, scheduler, scheduler.due(now), budget)
+                        if breaker.failures:
+                            self.connection_restored(plc, breaker)
+                        self.report_overruns(plc, scheduler, now)
+                        self.report_shed(plc, budget, now)
+
+                except Exception as e:
+                    session.close(e)
+                    await asyncio.sleep(self.connection_failed(plc, breaker, e))
+                    breaker.probe()
+        finally:
+            self.sessions.release(session)
+
+    async def run_async(self, keep_alive=False):
+        """
+        Poll every PLC until stop() is called; without `keep_alive`, also stop once every poller has
+        stopped by itself.
+        """
+        MonitoringEngine.apply_configs(self)
+        try:
+            while self.started:
+                tasks = [poller.worker for poller in self.pollers.values() if self.poller_alive(poller)]
+                if not tasks and not keep_alive:
+                    break
+                waiter = asyncio.ensure_future(self.wakeup.wait())
+                await asyncio.wait(tasks + [waiter], return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                self.wakeup.clear()
+        finally:
+            tasks = [poller.worker for poller in self.pollers.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def in_loop(self, function):
+        """Run `function()` on the event loop thread and wait for it."""
+        if threading.current_thread() is self.thread or not self.thread.is_alive():
+            return function()
+
+        async def call():
+            return function()
+
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result(STOP_TIMEOUT)
+
+    def apply_configs(self):
+        if not self.loop.is_closed():
+            self.in_loop(super().apply_configs)
+
+    def start_poller(self, poller):
+        poller.worker = self.loop.create_task(self.process_registers(poller))
+        self.wakeup.set()
+
+    def stop_pollers(self, pollers, timeout):
+        if self.loop.is_closed():
+            # run() already cancelled and gathered the tasks after an interrupt
+            return
+
+        def cancel():
+            for poller in pollers:
+                poller.worker.cancel()
+            self.wakeup.set()
+
+        self.in_loop(cancel)
+        if not self.started and self.thread is not threading.current_thread():
+            # Full stop: the loop ends once the cancelled tasks have finished
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.log(f"Asyncio engine did not stop within {timeout:g} s.")
+
+    def poller_alive(self, poller):
+        return poller.worker is not None and not poller.worker.done()
+
+    def is_running(self):
+        """Return True while the event loop thread is alive."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def prepare_loop(self, thread):
+        self.started = True
+        self.loop = asyncio.new_event_loop()
+        self.wakeup = asyncio.Event()
+        self.thread = thread
+
+    def run_loop(self, keep_alive):
+        try:
+            self.loop.run_until_complete(self.run_async(keep_alive))
+        finally:
+            self.loop.close()
+
+    def finish_interrupted(self, main):
+        """
+        After Ctrl-C, keep running the loop until run_async() has cancelled and gathered the pollers,
+        so their sessions are closed and their captures emitted before the loop is closed.
+        """
+        with self.lifecycle_lock:
+            self.started = False
+        self.wakeup.set()
+        while not main.done():
+            try:
+                self.loop.run_until_complete(asyncio.wait([main]))
+            except KeyboardInterrupt:
+                continue
+        if not main.cancelled():
+            main.exception()
+        # The interrupt may have been raised inside run_async() itself, before it gathered its tasks
+        pending = [task for task in asyncio.all_tasks(self.loop) if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+    def start(self):
+        """Run the event loop in a background thread until stop() is called."""
+        with self.lifecycle_lock:
+            if self.started:
+                return
+            self.prepare_loop(threading.Thread(target=self.run_loop, args=(True,), daemon=True))
+            self.thread.start()
+
+    def run(self):
+        with self.lifecycle_lock:
+            if self.started:
+                return
+            self.prepare_loop(threading.current_thread())
+        main = self.loop.create_task(self.run_async(False))
+        try:
+            self.loop.run_until_complete(main)
+        except KeyboardInterrupt:
+            self.finish_interrupted(main)
+            raise
+        finally:
+            self.loop.close()
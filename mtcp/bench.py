@@ -0,0 +1,304 @@
+"""
+Load test of the monitoring engines against simulated PLCs.
+
+    python -m mtcp.bench --plcs 20 --engine asyncio --duration 30
+
+Starts N Modbus TCP servers (pymodbus) on localhost in a child process. Each one pulses its trigger
+register on a schedule and writes a new data block before every pulse, numbered in its first register.
+The engine under test polls them in this process, so the CPU time and RSS reported are the engine's
+own; with `--workers` the CPU time includes the worker processes and the RSS of the largest one is
+reported too. The report lists captured and missed trigger edges, rows per second, Modbus requests and
+connections, CPU, RSS and the trigger-to-capture latency percentiles; `--json` also writes it to a
+file so runs can be compared between changes.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: CPU and RSS are not reported
+    resource = None
+
+from mtcp.cli import ENGINES, create_engine
+from mtcp.config import ConfigSet
+from mtcp.latency import LatencyRecorder
+from mtcp.metrics import METRICS
+from mtcp.sinks import CsvSink, SinkGroup
+
+# Layout of the holding registers of a simulated PLC
+SIM_TRIGGER_REGISTER = 0
+SIM_DATA_REGISTER = 10
+
+# Seconds the simulators get to start listening
+SIM_STARTUP_TIMEOUT = 10.0
+
+
+class SimulatedPLC:
+    """
+    Register map and trigger schedule of one simulated PLC.
+    Every `period` seconds (varied by up to `jitter` of a period) the data block gets new random values
+    with the pulse number in its first register, then the trigger register is held at 1 for `pulse_width` seconds.
+    """
+
+    def __init__(self, port, register_range, period, pulse_width, jitter=0.0):
+        self.port = port
+        self.register_range = register_range
+        self.period = period
+        self.pulse_width = pulse_width
+        self.jitter = jitter
+        self.pulses = 0
+
+    def create_context(self):
+        from pymodbus import datastore
+
+        # Starting the block at address 1 maps register N to value N on every pymodbus release
+        registers = datastore.ModbusSequentialDataBlock(1, [0] * (SIM_DATA_REGISTER + self.register_range + 1))
+        if hasattr(datastore, "ModbusDeviceContext"):  # pymodbus 3.10 and later
+            return datastore.ModbusServerContext(devices=datastore.ModbusDeviceContext(hr=registers), single=True)
+        return datastore.ModbusServerContext(slaves=datastore.ModbusSlaveContext(hr=registers), single=True)
+
+    async def run_pulses(self, server, end):
+        """Pulse the trigger until the monotonic time `end`."""
+        await asyncio.sleep(random.uniform(0, self.period))
+        while time.monotonic() < end:
+            self.pulses += 1
+            data = [random.randrange(0x10000) for _ in range(self.register_range)]
+            data[0] = self.pulses
+            await set_holding_registers(server, SIM_DATA_REGISTER, data)
+            await set_holding_registers(server, SIM_TRIGGER_REGISTER, [1])
+            await asyncio.sleep(self.pulse_width)
+            await set_holding_registers(server, SIM_TRIGGER_REGISTER, [0])
+            period = self.period * (1 + random.uniform(-self.jitter, self.jitter))
+            await asyncio.sleep(max(0.0, period - self.pulse_width))
+
+
+async def set_holding_registers(server, address, values):
+    """
+    Write holding registers of a served simulator. Older pymodbus releases serve its context itself;
+    newer ones copy it into their own datastore, written with async_setValues.
+    """
+    if hasattr(server.context, "__getitem__"):
+        server.context[0].setValues(3, address, values)
+    else:
+        await server.context.async_setValues(0, 3, address, values)
+
+
+async def serve_simulators(simulators, duration, connection):
+    """
+    Serve every simulator, send "ready", pulse the triggers for `duration` seconds, send the pulse
+    counts and keep serving until the parent sends "stop".
+    """
+    from pymodbus.server import ModbusTcpServer
+
+    contexts = [simulator.create_context() for simulator in simulators]
+    servers = [ModbusTcpServer(context, address=("127.0.0.1", simulator.port))
+               for simulator, context in zip(simulators, contexts)]
+    serving = [asyncio.create_task(server.serve_forever()) for server in servers]
+    await asyncio.sleep(0.5)  # Let the servers bind their ports
+    connection.send("ready")
+
+    end = time.monotonic() + duration
+    await asyncio.gather(*(simulator.run_pulses(server, end) for simulator, server in zip(simulators, servers)))
+    connection.send([simulator.pulses for simulator in simulators])
+
+    await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+    for server in servers:
+        await server.shutdown()
+    for task in serving:
+        task.cancel()
+    await asyncio.gather(*serving, return_exceptions=True)
+
+
+def simulator_process(simulators, duration, connection):
+    asyncio.run(serve_simulators(simulators, duration, connection))
+
+
+class CaptureCounter:
+    """Sink that records the pulse number of every capture per PLC."""
+
+    def __init__(self):
+        self.pulses = {}  # line name -> captured pulse numbers
+        self.captures = 0
+
+    def write(self, capture):
+        self.captures += 1
+        self.pulses.setdefault(capture.plc["line_name"], []).append(capture.registers[0])
+
+    def close(self):
+        pass
+
+
+def cpu_seconds(who=None):
+    """CPU seconds of this process, or with `who` = resource.RUSAGE_CHILDREN of its joined child processes."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def max_rss_mb(who=None):
+    """Peak RSS of this process, or with RUSAGE_CHILDREN that of the largest joined child process."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss / 1024  # Kilobytes on Linux
+
+
+def workers_measured(workers):
+    """
+    Whether the usage of the worker processes can be measured: once joined, they show up in
+    RUSAGE_CHILDREN, unless a forkserver started them.
+    """
+    return resource is not None and (not workers or multiprocessing.get_start_method() != "forkserver")
+
+
+def bench_configs(simulators, poll_interval_ms, csv_dir=None):
+    """The PLC and output configurations polling `simulators`."""
+    plcs = [{
+        "line_name": f"SIM{index + 1}",
+        "equipment_name": "Simulator",
+        "ip_address": "127.0.0.1",
+        "port": simulator.port,
+    } for index, simulator in enumerate(simulators)]
+    output = {
+        "file_name": "bench_{line_name}",
+        "register_type": "Holding",
+        "start_register": SIM_DATA_REGISTER,
+        "range": simulators[0].register_range,
+        "trigger_register_type": "Holding",
+        "trigger_register": SIM_TRIGGER_REGISTER,
+        "folder_path": csv_dir or "",
+        "poll_interval_ms": poll_interval_ms,
+    }
+    return ConfigSet(plcs, [output])
+
+
+def run_bench(args, log=print):
+    """Run one load test and return its report."""
+    simulators = [
+        SimulatedPLC(args.base_port + index, args.range, args.period_ms / 1000, args.pulse_ms / 1000, args.jitter)
+        for index in range(args.plcs)
+    ]
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=simulator_process, args=(simulators, args.duration, child_connection),
+                                      daemon=True)
+    process.start()
+    if not connection.poll(SIM_STARTUP_TIMEOUT):
+        process.terminate()
+        raise RuntimeError("The simulated PLCs did not start.")
+    connection.recv()
+
+    latency = LatencyRecorder()
+    counter = CaptureCounter()
+    sinks = [counter]
+    if args.csv_dir:
+        sinks.append(CsvSink(lambda message: None, latency=latency))
+    sink = SinkGroup(sinks)
+    engine = create_engine(args.engine, bench_configs(simulators, args.poll_interval_ms, args.csv_dir),
+                           sink, log, latency, args.workers)
+
+    requests_before = METRICS.total("mtcp_modbus_requests_total")
+    measured = workers_measured(args.workers)
+    if measured:
+        # The simulator process is only joined after the measurement, so the children counted are the workers
+        cpu_before = cpu_seconds() + cpu_seconds(resource.RUSAGE_CHILDREN)
+    start = time.monotonic()
+    engine.start()
+    pulses = connection.recv()  # Sent when the simulators stop pulsing
+    time.sleep(args.settle)
+    engine.stop()
+    elapsed = time.monotonic() - start
+    if measured:
+        cpu_after = cpu_seconds() + cpu_seconds(resource.RUSAGE_CHILDREN)
+    sink.close()
+
+    connection.send("stop")
+    process.join(SIM_STARTUP_TIMEOUT)
+    if process.is_alive():
+        process.terminate()
+
+    trigger_edges = sum(pulses)
+    captured = sum(len(set(numbers)) for numbers in counter.pulses.values())
+    requests = METRICS.total("mtcp_modbus_requests_total") - requests_before
+    report = {
+        "engine": args.engine,
+        "workers": args.workers,
+        "plcs": args.plcs,
+        "seconds": round(elapsed, 3),
+        "trigger_edges": trigger_edges,
+        "captured_edges": captured,
+        "missed_edges": trigger_edges - captured,
+        "duplicate_captures": counter.captures - captured,
+        "rows_per_second": round(counter.captures / elapsed, 1),
+        "modbus_requests": requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "connections": METRICS.total("mtcp_modbus_connections_total"),
+        "reconnects": METRICS.total("mtcp_modbus_reconnects_total"),
+        "read_errors": METRICS.total("mtcp_modbus_read_errors_total"),
+        "latency": latency.stage_summaries(),
+    }
+    if measured:
+        report["cpu_seconds"] = round(cpu_after - cpu_before, 3)
+        report["cpu_percent"] = round(100 * (cpu_after - cpu_before) / elapsed, 1)
+        report["max_rss_mb"] = round(max_rss_mb(), 1)
+        if args.workers:
+            report["worker_max_rss_mb"] = round(max_rss_mb(resource.RUSAGE_CHILDREN), 1)
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"Engine {report['engine']}, {report['workers']} worker process(es), {report['plcs']} PLC(s), "
+        f"{report['seconds']} s",
+        f"Trigger edges: {report['trigger_edges']}, captured {report['captured_edges']}, "
+        f"missed {report['missed_edges']}, duplicates {report['duplicate_captures']}",
+        f"Rows/s: {report['rows_per_second']}, Modbus requests/s: {report['requests_per_second']}",
+        f"Connections: {report['connections']}, reconnects {report['reconnects']}, read errors {report['read_errors']}",
+    ]
+    if "worker_max_rss_mb" in report:
+        lines.append(f"CPU (all processes): {report['cpu_seconds']} s ({report['cpu_percent']}%), "
+                     f"max RSS {report['max_rss_mb']} MB, largest worker {report['worker_max_rss_mb']} MB")
+    elif "cpu_seconds" in report:
+        lines.append(f"CPU: {report['cpu_seconds']} s ({report['cpu_percent']}%), max RSS {report['max_rss_mb']} MB")
+    else:
+        lines.append("CPU and RSS: not measured")
+    for stage, summary in report["latency"].items():
+        lines.append(f"Latency {stage}: p50 {summary['p50_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms, "
+                     f"max {summary['max_ms']:.2f} ms")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mtcp.bench",
+                                     description="Load test a monitoring engine against simulated PLCs.")
+    parser.add_argument("--engine", choices=ENGINES, default="threaded", help="engine under test (default: threaded)")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes polling the PLCs (default: 0)")
+    parser.add_argument("--plcs", type=int, default=10, help="number of simulated PLCs (default: 10)")
+    parser.add_argument("--base-port", type=int, default=15020, help="port of the first simulated PLC")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds the triggers are pulsed")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds the engine keeps running after the last pulse")
+    parser.add_argument("--period-ms", type=int, default=1000, help="trigger period of each PLC")
+    parser.add_argument("--pulse-ms", type=int, default=300, help="time each trigger pulse stays ON")
+    parser.add_argument("--jitter", type=float, default=0.1, help="random variation of the period, as a fraction")
+    parser.add_argument("--range", type=int, default=100, help="registers in the data block")
+    parser.add_argument("--poll-interval-ms", type=int, default=100, help="poll interval of the output")
+    parser.add_argument("--csv-dir", help="also write the captures to CSV files in this folder")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_bench(args)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""
+Request budget of one PLC: a token bucket of Modbus requests per second and a cap on requests in flight,
+spent on the outputs of a poll cycle in priority order.
+"""
+import math
+
+# Priority of the outputs of each category; lower numbers are served first
+CATEGORY_PRIORITY = {
+    "Traceability": 0,
+    "ErrorCodes": 1,
+    "DownTime": 2,
+}
+
+# Share of the bucket kept in reserve for more important outputs, per priority level below the second,
+# up to MAX_RESERVE
+LOW_PRIORITY_RESERVE = 0.25
+MAX_RESERVE = 0.75
+
+
+def output_priority(category, output):
+    """Priority of an output: its `priority`, or else that of its category."""
+    return int(output.get("priority", CATEGORY_PRIORITY.get(category, len(CATEGORY_PRIORITY))))
+
+
+def reserve_share(priority):
+    """Share of the bucket an output of `priority` has to leave to more important outputs."""
+    return min(LOW_PRIORITY_RESERVE * max(0, priority - 1), MAX_RESERVE)
+
+
+def minimum_burst(cycle_cost, output_costs):
+    """
+    Smallest burst that holds the `cycle_cost` requests of a poll cycle in which every output is due and
+    fires, and lets every output, given as (cost, priority) pairs, through a full bucket past its reserve.
+    """
+    burst = cycle_cost
+    for cost, priority in output_costs:
+        burst = max(burst, math.ceil(cost / (1 - reserve_share(priority))))
+    return float(burst)
+
+
+class RequestBudget:
+    """
+    Token bucket of `rate` requests per second holding up to `burst` tokens, plus `max_in_flight`
+    concurrent requests (the threaded engine sends one request at a time per PLC anyway).
+
+    Every output needs the tokens it spends. Priority 0 outputs are never shed: one that does not fit
+    waits until the bucket holds its requests, and its claim on them (`waiting`) keeps the other outputs
+    from spending those tokens meanwhile. Lower priorities also have to leave LOW_PRIORITY_RESERVE of
+    the bucket per level below the second (at most MAX_RESERVE), so they are shed first when the PLC
+    nears its budget.
+    """
+
+    def __init__(self, rate, burst, max_in_flight, now):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.tokens = burst
+        self.updated = now
+        self.slots = None  # asyncio.Semaphore of the in-flight cap, set by the asyncio engine
+        self.waiting = {}  # Priority 0 output waiting for tokens -> requests it claims
+        self.shed = 0
+        self.reported_shed = 0
+        self.last_report = now
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def allows(self, cost, priority):
+        """Return True if `cost` requests of an output with `priority` fit the budget."""
+        if self.rate is None or cost == 0:
+            return True
+        if priority > 0:
+            cost += sum(self.waiting.values())
+        return self.tokens - cost >= reserve_share(priority) * self.burst
+
+    def delay(self, cost):
+        """Seconds until the bucket holds `cost` requests."""
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def spend(self, cost):
+        if self.rate is not None:
+            self.tokens -= cost
+
+
+def create_budget(plc, now, minimum=1.0):
+    """
+    The RequestBudget of a PLC with `max_requests_per_s` (burst `request_burst`, one second's worth
+    by default, and at least `minimum`, see minimum_burst) and/or `max_in_flight`, or None if it has no budget.
+    """
+    rate = plc.get("max_requests_per_s")
+    max_in_flight = plc.get("max_in_flight")
+    if rate is None and max_in_flight is None:
+        return None
+    if rate is not None:
+        rate = float(rate)
+        burst = float(plc.get("request_burst", max(rate, 1.0)))
+        if rate <= 0 or burst < 1:
+            raise ValueError("max_requests_per_s must be positive and request_burst at least 1")
+        burst = max(burst, minimum)
+    else:
+        burst = None
+    if max_in_flight is not None and int(max_in_flight) < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    return RequestBudget(rate, burst, None if max_in_flight is None else int(max_in_flight), now)
@@ -0,0 +1,33 @@
+"""
+Captured register snapshots on their way from the pollers to the sinks.
+"""
+import time
+
+
+class Capture:
+    """
+    One captured snapshot of an output's register block, with the time it was captured.
+    `registers` is the compact array read from the PLC (see mtcp.modbus.new_values) and `tag_values`
+    the values of the output's typed tags, or None when it has none (see mtcp.tags).
+    A sample of a trigger window carries `window`, its (sample number relative to the edge, trigger value).
+    The monotonic nanosecond timestamps record when each stage was reached:
+    trigger observed, data read done and row enqueued for the sinks.
+    """
+
+    __slots__ = ("output", "plc", "category", "registers", "tag_values", "window", "capture_time", "trigger_ns", "data_ns", "enqueued_ns")
+
+    def __init__(self, output, plc, category, registers, capture_time, trigger_ns, data_ns):
+        self.output = output
+        self.plc = plc
+        self.category = category
+        self.registers = registers
+        self.tag_values = None
+        self.window = None
+        self.capture_time = capture_time  # Wall-clock time the trigger edge was observed
+        self.trigger_ns = trigger_ns
+        self.data_ns = data_ns
+        self.enqueued_ns = None
+
+    def enqueued(self):
+        """Record that the capture was handed to the sinks."""
+        self.enqueued_ns = time.monotonic_ns()
@@ -0,0 +1,112 @@
+"""
+Headless command line entry point: `python -m mtcp --config-dir DIR`.
+"""
+import argparse
+import logging
+
+from mtcp.config import ConfigSet
+from mtcp.latency import LatencyRecorder
+from mtcp.metrics import METRICS, MetricsServer
+from mtcp.sinks import SINK_FLUSH_INTERVAL, CsvSink, SinkGroup
+
+ENGINES = ["threaded", "asyncio"]
+SINKS = ["csv", "sqlite", "archive"]
+
+
+def engine_class(name):
+    """Return the monitoring engine class called `name`."""
+    if name == "asyncio":
+        from mtcp.async_engine import AsyncEngine
+        return AsyncEngine
+    from mtcp.engine import ThreadedEngine
+    return ThreadedEngine
+
+
+def create_engine(name, configs, sink, log, latency=None, workers=0):
+    """
+    Create the monitoring engine called `name` for `configs`.
+    With `workers`, the PLCs are sharded over that many processes each running such an engine.
+    """
+    if workers:
+        from mtcp.shard import ShardedEngine
+        return ShardedEngine(configs.plc_configs, configs.outputs(), sink, log, latency, workers, name)
+    return engine_class(name)(configs.plc_configs, configs.outputs(), sink, log, latency)
+
+
+def create_sink(args, log, latency=None):
+    """Create the sinks selected with --sink."""
+    sinks = []
+    for name in args.sink or ["csv"]:
+        if name == "csv":
+            sinks.append(CsvSink(log, flush_interval=args.flush_interval, fsync=args.csv_fsync, latency=latency,
+                                 spool_dir=args.spool_dir))
+        elif name == "sqlite":
+            from mtcp.sqlite_sink import SqliteSink
+            sinks.append(SqliteSink(args.sqlite_path, log, flush_interval=args.flush_interval, latency=latency,
+                                    spool_dir=args.spool_dir))
+        elif name == "archive":
+            from mtcp.archive import ArchiveSink
+            sinks.append(ArchiveSink(log, flush_interval=args.flush_interval, latency=latency,
+                                     spool_dir=args.spool_dir))
+    if len(sinks) == 1:
+        return sinks[0]
+    return SinkGroup(sinks)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="mtcp", description="Log PLC register data over Modbus TCP without a GUI.")
+    parser.add_argument("--config-dir", default=".", help="directory holding the four JSON configuration files")
+    parser.add_argument("--engine", choices=ENGINES, default="threaded", help="polling engine (default: threaded)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="shard the PLCs over this many worker processes (default: 0, poll in this process)")
+    parser.add_argument("--sink", action="append", choices=SINKS,
+                        help="output sink, may be given several times (default: csv)")
+    parser.add_argument("--sqlite-path", default="mtcp.sqlite3", help="database file of the sqlite sink")
+    parser.add_argument("--flush-interval", type=float, default=SINK_FLUSH_INTERVAL,
+                        help="seconds between flushes of the sinks, 0 flushes after every batch")
+    parser.add_argument("--csv-fsync", action="store_true", help="fsync the CSV files on every flush")
+    parser.add_argument("--spool-dir",
+                        help="local folder the captures are spooled to before each sink writes them (default: disabled)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this port (default: disabled)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address of the metrics endpoint")
+    parser.add_argument("--latency-dump", help="JSON file the latency histograms are written to on exit")
+    parser.add_argument("--log-level", default="INFO", help="logging level (default: INFO)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("mtcp")
+
+    configs = ConfigSet.load(args.config_dir)
+    if not configs.plc_configs or not configs.outputs():
+        logger.error("No PLC or output configurations found in '%s'.", args.config_dir)
+        return 1
+
+    latency = LatencyRecorder()
+    METRICS.latency = latency
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(args.metrics_port, args.metrics_host)
+        logger.info("Serving metrics on http://%s:%d/metrics", args.metrics_host, args.metrics_port)
+    sink = create_sink(args, logger.info, latency)
+    engine = create_engine(args.engine, configs, sink, logger.info, latency, args.workers)
+    logger.info("Monitoring %d PLC(s) with the %s engine...", len(configs.plc_configs), args.engine)
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        logger.info("Monitoring stopped.")
+    finally:
+        try:
+            engine.stop()
+        finally:
+            try:
+                sink.close()
+            finally:
+                if metrics_server is not None:
+                    metrics_server.close()
+                if args.latency_dump:
+                    latency.dump(args.latency_dump)
+    return 0
@@ -0,0 +1,129 @@
+"""
+Loading and saving of the four JSON configuration files.
+"""
+import json
+import os
+
+# File paths for storing configurations
+PLC_CONFIG_FILE = "plc_configs.json"
+TRACEABILITY_CONFIG_FILE = "traceability_configs.json"
+ERROR_CODE_CONFIG_FILE = "error_code_configs.json"
+DOWN_TIME_CONFIG_FILE = "down_time_configs.json"
+
+
+def load_config_file(path):
+    """Load a list of configurations from a JSON file, or an empty list if the file does not exist."""
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+    return []
+
+
+def save_config_file(path, configs):
+    """Save a list of configurations to a JSON file."""
+    with open(path, "w") as file:
+        json.dump(configs, file, indent=4)
+
+
+def monitored_outputs(traceability_configs, error_code_configs, down_time_configs):
+    """Return (category, output) pairs for every configured output."""
+    outputs = []
+    for config_type, configs in [("Traceability", traceability_configs),
+                                 ("ErrorCodes", error_code_configs),
+                                 ("DownTime", down_time_configs)]:
+        for config in configs:
+            outputs.append((config_type, config))
+    return outputs
+
+
+# Output keys that assign an output to PLCs, and the PLC key each one matches
+OUTPUT_TARGETS = [
+    ("plcs", "ip_address"),
+    ("lines", "line_name"),
+    ("equipment", "equipment_name"),
+]
+
+# PLC fields an output template may refer to as {line_name}, {equipment_name} or {ip_address}
+TEMPLATE_FIELDS = ["line_name", "equipment_name", "ip_address"]
+
+
+def parse_names(text):
+    """Split a comma-separated list of names, as typed in the GUI."""
+    return [name.strip() for name in text.split(",") if name.strip()]
+
+
+def format_names(names):
+    """Inverse of parse_names."""
+    return ", ".join(names or [])
+
+
+def output_applies(output, plc):
+    """
+    Return True if `output` is polled on `plc`.
+    An output is assigned with any of `plcs` (IP addresses), `lines` (line names), `equipment`
+    (equipment names) and `groups` (names listed in the PLC's own `groups`); it is polled on every PLC
+    matching one of them. An output without any of these keys is polled on every PLC.
+    """
+    assigned = False
+    for output_key, plc_key in OUTPUT_TARGETS:
+        names = output.get(output_key)
+        if names:
+            assigned = True
+            if plc.get(plc_key) in names:
+                return True
+    groups = output.get("groups")
+    if groups:
+        assigned = True
+        if set(groups) & set(plc.get("groups", [])):
+            return True
+    return not assigned
+
+
+def expand_output(output, plc):
+    """
+    Fill in an output shared as a template by several identical stations: {line_name},
+    {equipment_name} and {ip_address} in its text values are replaced with the PLC's.
+    """
+    expanded = {}
+    for key, value in output.items():
+        if isinstance(value, str) and "{" in value:
+            for field in TEMPLATE_FIELDS:
+                value = value.replace("{" + field + "}", str(plc.get(field, "")))
+        expanded[key] = value
+    return expanded
+
+
+def assigned_outputs(plc, outputs):
+    """Return the (category, output) pairs of `outputs` assigned to `plc`, with templates filled in."""
+    return [(category, expand_output(output, plc)) for category, output in outputs if output_applies(output, plc)]
+
+
+class ConfigSet:
+    """The PLC, TRACEABILITY, ERROR_CODE and DOWN_TIME configurations a monitoring engine runs from."""
+
+    def __init__(self, plc_configs=None, traceability_configs=None, error_code_configs=None, down_time_configs=None):
+        self.plc_configs = plc_configs or []
+        self.traceability_configs = traceability_configs or []
+        self.error_code_configs = error_code_configs or []
+        self.down_time_configs = down_time_configs or []
+
+    @classmethod
+    def load(cls, config_dir="."):
+        """Load all configurations from the JSON files in `config_dir`."""
+        return cls(
+            load_config_file(os.path.join(config_dir, PLC_CONFIG_FILE)),
+            load_config_file(os.path.join(config_dir, TRACEABILITY_CONFIG_FILE)),
+            load_config_file(os.path.join(config_dir, ERROR_CODE_CONFIG_FILE)),
+            load_config_file(os.path.join(config_dir, DOWN_TIME_CONFIG_FILE)),
+        )
+
+    def save(self, config_dir="."):
+        """Save all configurations to the JSON files in `config_dir`."""
+        save_config_file(os.path.join(config_dir, PLC_CONFIG_FILE), self.plc_configs)
+        save_config_file(os.path.join(config_dir, TRACEABILITY_CONFIG_FILE), self.traceability_configs)
+        save_config_file(os.path.join(config_dir, ERROR_CODE_CONFIG_FILE), self.error_code_configs)
+        save_config_file(os.path.join(config_dir, DOWN_TIME_CONFIG_FILE), self.down_time_configs)
+
+    def outputs(self):
+        """Return (category, output) pairs for every configured output."""
+        return monitored_outputs(self.traceability_configs, self.error_code_configs, self.down_time_configs)
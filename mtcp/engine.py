@@ -0,0 +1,778 @@
+"""
+Monitoring engines: poll the trigger registers of every PLC and capture register data on trigger edges.
+"""
+import threading
+import time
+from collections import deque
+
+from mtcp.budget import create_budget, minimum_burst, output_priority
+from mtcp.capture import Capture
+from mtcp.config import assigned_outputs
+from mtcp.metrics import METRICS
+from mtcp.modbus import READ_FUNCTIONS, READ_GAP_FILL, WRITE_FUNCTIONS, PLCSession, ReadFailure, SessionPool, gateway_key, unit_id
+from mtcp.plan import PollPlan
+from mtcp.schedule import OVERRUN_REPORT_INTERVAL, POLL_INTERVAL_MS, PollScheduler
+from mtcp.supervise import CircuitBreaker
+from mtcp.tags import compile_tags
+
+
+# Seconds stop() waits for the pollers to finish
+STOP_TIMEOUT = 5.0
+
+
+# Capture modes of an output: on the trigger's rising edge, sampled at the poll interval,
+# a window of samples around the trigger edge, on every increment of a sequence counter,
+# or on the trigger's rising edge with an acknowledgement written back to the PLC
+MODE_TRIGGER = "trigger"
+MODE_CONTINUOUS = "continuous"
+MODE_WINDOW = "window"
+MODE_COUNTER = "counter"
+MODE_HANDSHAKE = "handshake"
+MODES = (MODE_TRIGGER, MODE_CONTINUOUS, MODE_WINDOW, MODE_COUNTER, MODE_HANDSHAKE)
+
+# Modulus of a sequence-counter trigger register; a step back by more than half of it is taken as a counter reset
+COUNTER_MODULUS = 0x10000
+
+# Largest pre- or post-trigger window of an output, in samples
+MAX_WINDOW_SAMPLES = 10000
+
+
+def plc_key(plc):
+    """Identity of a PLC configuration; the engines run at most one poller per key."""
+    return (plc["line_name"], plc["ip_address"], str(plc["port"]), unit_id(plc))
+
+
+class Poller:
+    """
+    Control block of the poller of one PLC: the configuration it runs with, its stop signal and
+    the thread or task running it.
+    `outputs` may be replaced while the poller runs; it rebuilds its read plan on the next cycle.
+    """
+
+    def __init__(self, plc, outputs):
+        self.plc = plc
+        self.outputs = outputs
+        self.stopping = threading.Event()
+        self.worker = None
+
+
+def deadband_values(deadband, register_range):
+    """Per-register deadbands from the output's `deadband`: one number for every register, or a list."""
+    if isinstance(deadband, list):
+        values = [float(value) for value in deadband[:register_range]]
+        return values + [0.0] * (register_range - len(values))
+    return [float(deadband)] * register_range
+
+
+class OutputState:
+    """
+    Trigger and dedup state of one output configuration on one PLC.
+    Both monitoring engines drive it, so they capture on exactly the same conditions.
+
+    In continuous mode (`"mode": "continuous"`) there is no trigger: the block is read every poll
+    interval and logged when a register moved more than its `deadband` from the last logged row,
+    or when `heartbeat_s` seconds passed since that row.
+
+    In window mode (`"mode": "window"`) the block and the trigger are sampled every poll interval
+    into a ring buffer of the last `pre_samples` samples. A trigger edge (a rising edge, or with
+    `"trigger_edge": "change"` any change of a latched or counter trigger value) dumps those samples,
+    the edge sample and the following `post_samples` samples as one window. An edge while a window is
+    still collecting its post-trigger samples is part of that window and opens none of its own, so
+    every sample is emitted at most once.
+
+    In counter mode (`"mode": "counter"`) the trigger register is a sequence counter: every increment
+    is an event and captures the block, and increments skipped between two polls are counted as missed.
+    In handshake mode (`"mode": "handshake"`) the PLC holds its data while the trigger is ON; after the
+    capture the engine writes `ack_value` (default 1) to `ack_register` and clears it once the PLC
+    drops the trigger. Neither mode skips data equal to the previous capture.
+
+    The data block is read with the output's `register_type` (Holding by default) and, when the
+    output lists `tags`, decoded by its precompiled TagDecoder (see mtcp.tags).
+    """
+
+    def __init__(self, category, output):
+        self.category = category
+        self.output = output
+        self.mode = output.get("mode", MODE_TRIGGER)
+        self.priority = output_priority(category, output)
+        self.start_register = int(output["start_register"])
+        self.register_range = int(output["range"])
+        self.poll_interval = int(output.get("poll_interval_ms", POLL_INTERVAL_MS)) / 1000
+        self.data_span = (output.get("register_type", "Holding"), self.start_register, self.register_range)
+        self.decoder = compile_tags(output)
+        self.logged_register_data = None  # Bytes of the last written register data
+        self.previous_trigger_status = False  # Tracks the trigger's ON/OFF state
+        if self.mode == MODE_CONTINUOUS:
+            self.trigger_span = None
+            self.deadbands = deadband_values(output.get("deadband", 0), self.register_range)
+            self.heartbeat = float(output.get("heartbeat_s", 0))
+            self.logged_values = None  # Values of the last written row
+            self.logged_time = None  # Monotonic time of the last written row
+        else:
+            self.trigger_register = int(output["trigger_register"])
+            self.trigger_type = output["trigger_register_type"]
+            self.trigger_span = (self.trigger_type, self.trigger_register, 1)
+        if self.mode == MODE_COUNTER:
+            self.counter = None  # Counter value at the last poll
+            self.previous_counter = None
+            self.missed = 0  # Increments skipped before the current event, reported once its data is read
+        elif self.mode == MODE_HANDSHAKE:
+            self.ack_register = int(output["ack_register"])
+            self.ack_type = output.get("ack_register_type", "Holding")
+            self.ack_value = int(output.get("ack_value", 1))
+            self.acked = True  # So a stale acknowledgement left by an earlier run is cleared first
+            self.ack_pending = None  # Value still to be written to the acknowledge register
+        if self.mode == MODE_WINDOW:
+            self.pre_samples = int(output.get("pre_samples", 0))
+            self.post_samples = int(output.get("post_samples", 0))
+            self.edge_on_change = output.get("trigger_edge", "rising") == "change"
+            self.history = deque(maxlen=self.pre_samples + 1)  # (time, trigger value, registers)
+            self.window = None  # Open window: [samples, post-trigger samples still missing]
+            self.trigger_value = None  # Trigger value of the current sample
+            self.edge = False  # Whether the current sample is a trigger edge
+            self.edge_pending = False  # An edge whose data read failed, opening its window with the next sample
+
+    def counter_step(self, counter):
+        """
+        Return True if a new value of a sequence-counter trigger is an event; the increments skipped
+        before it are kept in `missed`.
+        """
+        previous, self.counter = self.counter, counter
+        self.previous_counter = previous
+        self.missed = 0
+        if previous is None:  # First poll: only the baseline
+            return False
+        increment = (counter - previous) % COUNTER_MODULUS
+        if increment == 0:
+            return False
+        if increment <= COUNTER_MODULUS // 2:  # A larger step back is the PLC resetting its counter
+            self.missed = increment - 1
+        return True
+
+    def retry_trigger(self):
+        """Forget the trigger event of this cycle, whose data was not read, so the next cycle sees it again."""
+        if self.mode == MODE_WINDOW:
+            # The edge state already follows the trigger, which is sampled on every poll: only an edge
+            # sample is kept pending, so neither a held trigger nor a changed value makes a window twice
+            self.edge_pending = self.edge_pending or self.edge
+            return
+        self.previous_trigger_status = False
+        if self.mode == MODE_COUNTER:
+            self.counter = self.previous_counter
+            self.missed = 0  # Counted again by the next cycle
+
+    def handshake_trigger(self, trigger_value):
+        """Return True on a rising edge of a handshake trigger; a dropped trigger clears the acknowledgement."""
+        if trigger_value != 1 and self.acked and self.ack_pending is None:
+            self.ack_pending = 0
+        return self.trigger_edge(trigger_value)
+
+    def acknowledged(self, value):
+        """Record that `value` was written to the acknowledge register."""
+        self.acked = value != 0
+        self.ack_pending = None
+
+    def sample_trigger(self, trigger_value):
+        """Record the trigger value of the current window sample and whether it is an edge."""
+        if trigger_value is None:
+            self.edge = False
+        else:
+            if self.edge_on_change:
+                self.edge = self.trigger_value is not None and trigger_value != self.trigger_value
+            else:
+                self.edge = self.trigger_edge(trigger_value)
+            self.edge = self.edge or self.edge_pending
+            self.edge_pending = False
+        self.trigger_value = trigger_value
+
+    def add_sample(self, registers, sample_time):
+        """
+        Add the current window sample to the open window, or else to the ring buffer, where an edge opens
+        a window. The ring buffer starts over with every window, so no sample goes into two of them.
+        Returns the samples of the window completed by this sample, each (time, trigger value, registers), or None.
+        """
+        sample = (sample_time, self.trigger_value, registers)
+        if self.window is not None:
+            self.window[0].append(sample)
+            self.window[1] -= 1
+        else:
+            self.history.append(sample)
+            if self.edge:
+                self.window = [list(self.history), self.post_samples]
+                self.history.clear()
+        if self.window is None or self.window[1] > 0:
+            return None
+        samples, self.window = self.window[0], None
+        return samples
+
+    @property
+    def samples_every_poll(self):
+        """Whether the data block is read on every poll rather than on trigger events."""
+        return self.mode in (MODE_CONTINUOUS, MODE_WINDOW)
+
+    def trigger_edge(self, trigger_value):
+        """Return True when the trigger transitions from OFF to ON."""
+        if trigger_value == 1:
+            if not self.previous_trigger_status:
+                self.previous_trigger_status = True
+                return True
+        elif self.previous_trigger_status:  # Transition back to OFF
+            self.previous_trigger_status = False
+        return False
+
+    def is_new_data(self, registers):
+        """
+        Return True (and remember the data) if it differs from the last logged state.
+        The array of values is compared as raw bytes.
+        """
+        data = registers.tobytes()
+        if data == self.logged_register_data:
+            return False
+        self.logged_register_data = data
+        return True
+
+    def is_outside_deadband(self, registers):
+        """Return True if any register moved more than its deadband from the last logged row."""
+        if self.logged_values is None or len(registers) != len(self.logged_values):
+            return True
+        for value, logged, deadband in zip(registers, self.logged_values, self.deadbands):
+            if abs(value - logged) > deadband:
+                return True
+        return False
+
+    def should_capture(self, registers, now):
+        """Decide whether the data read at monotonic time `now` is written, and remember it if so."""
+        if self.mode in (MODE_COUNTER, MODE_HANDSHAKE):  # Every event is captured
+            return True
+        if self.mode != MODE_CONTINUOUS:
+            return self.is_new_data(registers)
+        # The bytes compare skips the deadband check while nothing moved at all
+        changed = registers.tobytes() != self.logged_register_data and self.is_outside_deadband(registers)
+        if not changed and not (self.heartbeat and now - self.logged_time >= self.heartbeat):
+            return False
+        self.logged_values = registers
+        self.logged_register_data = registers.tobytes()
+        self.logged_time = now
+        return True
+
+
+class MonitoringEngine:
+    """
+    Shared part of the monitoring engines.
+    Write each PLC's register data to the sink only when:
+        - The trigger register transitions ON (value = 1).
+        - Register data has changed since the last recorded state.
+        - Data is written only once per trigger event.
+    """
+
+    session_class = None  # Modbus session of the engine's pollers
+
+    def __init__(self, plc_configs, outputs, sink, log=print, latency=None):
+        self.plc_configs = plc_configs
+        self.outputs = outputs  # (category, output) pairs
+        self.sink = sink
+        self.log = log
+        self.latency = latency  # Optional LatencyRecorder
+        self.pollers = {}  # plc_key -> Poller
+        self.sessions = SessionPool(self.session_class)  # Connections shared by the PLCs of one address
+        self.started = False
+        self.lifecycle_lock = threading.Lock()
+
+    def open_session(self, plc):
+        """
+        Return the session of `plc` on the connection to its address. PLCs behind one gateway, told
+        apart by `unit_id`, share it; its response timeout is the longest `timeout_s` among them.
+        """
+        timeouts = [float(other["timeout_s"]) for other in self.plc_configs
+                    if gateway_key(other) == gateway_key(plc) and other.get("timeout_s") is not None]
+        return self.sessions.open(plc, max(timeouts, default=None))
+
+    def outputs_for(self, plc):
+        """Return the (category, output) pairs polled on one PLC (see assigned_outputs)."""
+        return assigned_outputs(plc, self.outputs)
+
+    def build_output_states(self, plc, outputs, previous_states=()):
+        """
+        Create the tracking state of every valid output configuration for one PLC.
+        Outputs whose configuration is unchanged keep their state from `previous_states`.
+        """
+        required_keys = ["start_register", "range"]
+        trigger_keys = ["trigger_register", "trigger_register_type"]
+        previous = list(previous_states)
+        states = []
+        for category, output in outputs:
+            mode = output.get("mode", MODE_TRIGGER)
+            if mode not in MODES:
+                self.log(f"Unsupported mode: '{mode}' for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if mode == MODE_CONTINUOUS:
+                keys = required_keys
+            elif mode == MODE_HANDSHAKE:
+                keys = required_keys + trigger_keys + ["ack_register"]
+            else:
+                keys = required_keys + trigger_keys
+            if not all(key in output for key in keys):
+                self.log(f"Invalid Output Configuration for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            try:
+                window = [int(output.get(key, 0)) for key in ("pre_samples", "post_samples")]
+                poll_interval_ms = int(output.get("poll_interval_ms", POLL_INTERVAL_MS))
+            except (TypeError, ValueError):
+                self.log(f"Invalid Output Configuration for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if mode == MODE_WINDOW and not all(0 <= samples <= MAX_WINDOW_SAMPLES for samples in window):
+                self.log(f"Invalid trigger window for PLC '{plc['line_name']}' in category '{category}'; "
+                         f"at most {MAX_WINDOW_SAMPLES} samples before and after the trigger.")
+                continue
+            if mode != MODE_CONTINUOUS and output["trigger_register_type"] not in READ_FUNCTIONS:
+                self.log(f"Unsupported trigger register type: '{output['trigger_register_type']}' for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if mode == MODE_COUNTER and output["trigger_register_type"] not in ("Holding", "Input"):
+                self.log(f"A counter trigger needs a Holding or Input register for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if mode == MODE_HANDSHAKE and output.get("ack_register_type", "Holding") not in WRITE_FUNCTIONS:
+                self.log(f"Unsupported acknowledge register type: '{output['ack_register_type']}' for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if output.get("register_type", "Holding") not in READ_FUNCTIONS:
+                self.log(f"Unsupported register type: '{output['register_type']}' for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if output.get("tags") and output.get("register_type", "Holding") not in ("Holding", "Input"):
+                self.log(f"Tags need Holding or Input registers for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            if poll_interval_ms <= 0:
+                self.log(f"Invalid poll interval for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+            state = next((state for state in previous
+                          if state.category == category and state.output == output), None)
+            if state is not None:
+                previous.remove(state)
+            else:
+                try:
+                    state = OutputState(category, output)
+                except (KeyError, TypeError, ValueError) as e:
+                    self.log(f"Invalid tags for PLC '{plc['line_name']}' in category '{category}': {e}")
+                    continue
+            states.append(state)
+        return states
+
+    def build_plan(self, plc, outputs, previous_states=()):
+        """Create the read plan for every output of one PLC."""
+        try:
+            gap_fill = int(plc.get("gap_fill", READ_GAP_FILL))
+        except (TypeError, ValueError) as e:
+            self.log(f"Invalid read gap fill for PLC '{plc['line_name']}' ({e}); using {READ_GAP_FILL}.")
+            gap_fill = READ_GAP_FILL
+        return PollPlan(self.build_output_states(plc, outputs, previous_states), gap_fill)
+
+    def create_budget(self, plc, plan, now):
+        """
+        Create the request budget of one PLC (see mtcp.budget), or None if it has none.
+        Its burst is raised to what the outputs of `plan` need to get through (see minimum_burst).
+        """
+        minimum = minimum_burst(sum(block.requests for block in plan.output_blocks(plan.states)),
+                                [(sum(block.requests for block in plan.output_blocks([state])), state.priority)
+                                 for state in plan.states])
+        try:
+            budget = create_budget(plc, now, minimum)
+        except ValueError as e:
+            self.log(f"Invalid request budget for PLC '{plc['line_name']}' ({e}); polling without one.")
+            return None
+        if budget is not None and budget.rate is not None and budget.burst > float(plc.get("request_burst", budget.burst)):
+            self.log(f"request_burst of PLC '{plc['line_name']}' raised to {budget.burst:g}, "
+                     f"the requests its outputs need in one poll cycle.")
+        return budget
+
+    def admit(self, plc, budget, plan, scheduler, states, paid, now):
+        """
+        Return the outputs among `states` whose reads fit the PLC's request budget, most important first.
+        An output is only admitted if the bucket also holds the data read it makes once its trigger fires,
+        so a trigger read is never spent on an edge whose data cannot be read; the trigger reads are spent
+        here and the data reads by spend_data(). A block in `paid`, already admitted this cycle, costs
+        nothing more. A priority 0 output that does not fit is deferred until the bucket holds its
+        requests; other outputs that do not fit are shed until their next poll.
+        """
+        states = sorted(states, key=lambda state: state.priority)
+        if budget is None:
+            return states
+        budget.refill(now)
+        admitted = []
+        reserved = set()  # Data blocks of the admitted outputs
+        for state in states:
+            trigger_blocks = [block for block in plan.trigger_blocks([state]) if block not in paid]
+            data_blocks = [block for block in plan.data_blocks([state])
+                           if block not in paid and block not in reserved and block not in trigger_blocks]
+            cost = sum(block.requests for block in trigger_blocks)
+            data_cost = sum(block.requests for block in data_blocks)
+            needed = cost + data_cost + sum(block.requests for block in reserved)
+            if state.priority <= 0:
+                budget.waiting.pop(state, None)
+            if budget.allows(needed, state.priority):
+                budget.spend(cost)
+                paid.update(trigger_blocks)
+                reserved.update(data_blocks)
+                admitted.append(state)
+            elif state.priority <= 0:
+                budget.waiting[state] = cost + data_cost
+                scheduler.defer(state, now + budget.delay(needed))
+            else:
+                budget.shed += 1
+                METRICS.inc("mtcp_requests_shed_total", cost + data_cost if state.samples_every_poll else cost,
+                            plc=plc["line_name"], category=state.category)
+        return admitted
+
+    def spend_data(self, budget, plan, fired, paid):
+        """Spend the data reads of the fired outputs, which admit() kept in the bucket for them."""
+        if budget is None:
+            return
+        blocks = [block for block in plan.data_blocks(fired) if block not in paid]
+        budget.spend(sum(block.requests for block in blocks))
+        paid.update(blocks)
+
+    def report_shed(self, plc, budget, now):
+        """Report outputs shed by the request budget, at most every OVERRUN_REPORT_INTERVAL."""
+        if budget is None or budget.shed == budget.reported_shed or now - budget.last_report < OVERRUN_REPORT_INTERVAL:
+            return
+        self.log(f"PLC '{plc['line_name']}' is at its request budget; {budget.shed - budget.reported_shed} "
+                 f"lower-priority poll(s) were postponed.")
+        budget.reported_shed = budget.shed
+        budget.last_report = now
+
+    def report_read_failures(self, plc, plan, scheduler, states, results):
+        """
+        Apply the failed reads of one poll cycle of `states` to the plan and scheduler and report them.
+        If no read succeeded, raises ReadFailure, which the poller handles like a lost connection.
+        An output whose own read failed is suspended and polled again after a backoff delay.
+        """
+        for state in states:
+            if plan.span_values(state.data_span, results) is not None and scheduler.recovered(state):
+                self.log(f"Reading PLC '{plc['line_name']}' in category '{state.category}' works again.")
+        now = time.monotonic()
+        split, failures = plan.handle_failures(results, now)
+        if split:
+            self.log(f"Merged read failed for PLC '{plc['line_name']}', reading its registers separately.")
+        elif results and not any(results.values()):
+            raise ReadFailure("every read was answered with an error")
+        elif plan.remerge(now):
+            self.log(f"Reading the registers of PLC '{plc['line_name']}' in merged requests again.")
+        for state, description in failures:
+            if state in scheduler.suspended:
+                continue  # Both of its reads failed
+            delay = scheduler.suspend(state, now)
+            self.log(f"Error reading {description} for PLC '{plc['line_name']}' in category '{state.category}'; "
+                     f"retrying in {delay:.1f} s.")
+
+    def create_breaker(self, plc):
+        """Create the circuit breaker of one PLC and expose its state as a metric."""
+        breaker = CircuitBreaker()
+        METRICS.gauge("mtcp_plc_circuit_open", lambda: int(breaker.is_open), plc=plc["line_name"])
+        return breaker
+
+    def connection_failed(self, plc, breaker, error):
+        """Record a failed connection or poll cycle; returns the seconds to wait before reconnecting."""
+        probe_failed = breaker.state == CircuitBreaker.HALF_OPEN
+        delay = breaker.record_failure()
+        if probe_failed:
+            self.log(f"PLC '{plc['line_name']}' is still unreachable ({error}); next attempt in {delay:.0f} s.")
+        elif breaker.is_open:
+            self.log(f"PLC '{plc['line_name']}' failed {breaker.failures} times in a row ({error}); "
+                     f"pausing reconnects for {delay:.0f} s.")
+        else:
+            self.log(f"Lost connection to PLC '{plc['line_name']}' ({error}); reconnecting in {delay:.1f} s.")
+        return delay
+
+    def connection_restored(self, plc, breaker):
+        """Close the circuit after a successful poll cycle."""
+        if breaker.record_success():
+            self.log(f"Reconnected to PLC '{plc['line_name']}'.")
+
+    def report_overruns(self, plc, scheduler, now):
+        """Report poll cycles that missed their deadline, at most every OVERRUN_REPORT_INTERVAL."""
+        if scheduler.overruns > scheduler.exported_overruns:
+            METRICS.inc("mtcp_poll_overruns_total", scheduler.overruns - scheduler.exported_overruns,
+                        plc=plc["line_name"])
+            scheduler.exported_overruns = scheduler.overruns
+        overruns = scheduler.overrun_report(now)
+        if overruns:
+            self.log(f"PLC '{plc['line_name']}' missed {overruns} poll deadline(s); total {scheduler.overruns}.")
+
+    def collect_triggers(self, plc, plan, states, results):
+        """
+        Return the outputs among `states` whose trigger transitioned from OFF to ON in this cycle's trigger reads
+        or whose sequence counter moved, and the continuous and window outputs, which are read on every cycle.
+        """
+        fired = []
+        for state in states:
+            if state.trigger_span is None:
+                fired.append(state)
+                continue
+            trigger_values = plan.span_values(state.trigger_span, results)
+            if state.mode == MODE_WINDOW:
+                state.sample_trigger(trigger_values[0] if trigger_values else None)
+                fired.append(state)
+                continue
+            if trigger_values is None:
+                continue
+            if state.mode == MODE_COUNTER:
+                if state.counter_step(trigger_values[0]):
+                    fired.append(state)
+            elif state.mode == MODE_HANDSHAKE:
+                if state.handshake_trigger(trigger_values[0]):
+                    fired.append(state)
+            elif state.trigger_edge(trigger_values[0]):
+                fired.append(state)
+        return fired
+
+    def report_missed_events(self, plc, state, missed):
+        """Count the increments of a sequence-counter trigger that happened between two polls."""
+        METRICS.inc("mtcp_missed_events_total", missed, plc=plc["line_name"], output=state.output.get("file_name", ""))
+        self.log(f"PLC '{plc['line_name']}' counted {missed} event(s) in category '{state.category}' "
+                 f"between two polls; their data was not captured.")
+
+    def acknowledgements(self, states):
+        """Return the handshake outputs among `states` with an acknowledge register value to write."""
+        return [state for state in states if state.mode == MODE_HANDSHAKE and state.ack_pending is not None]
+
+    def acknowledge_failed(self, plc, state):
+        self.log(f"Error writing the acknowledge register {state.ack_register} for PLC '{plc['line_name']}' "
+                 f"in category '{state.category}'; retrying on the next cycle.")
+
+    def collect_data(self, plc, plan, fired, results, capture_time, trigger_ns):
+        """
+        Return a Capture for every fired output whose register data changed since the last logged state
+        (beyond the deadbands of a continuous output, see OutputState.should_capture).
+        Outputs whose data read failed will detect the trigger edge again on the next cycle.
+        A window output returns one Capture per sample of the window completed in this cycle, if any.
+        """
+        data_ns = time.monotonic_ns()
+        now = trigger_ns / 1e9
+        captures = []
+        for state in fired:
+            current_registers = plan.span_values(state.data_span, results)
+            if not current_registers:
+                state.retry_trigger()
+                continue
+            if state.mode == MODE_COUNTER and state.missed:
+                # Reported only now, so an event whose data read is retried is counted once
+                self.report_missed_events(plc, state, state.missed)
+                state.missed = 0
+            if state.mode == MODE_WINDOW:
+                samples = state.add_sample(current_registers, capture_time)
+                if samples:
+                    captures.extend(self.window_captures(plc, state, samples, trigger_ns, data_ns))
+                continue
+            if state.should_capture(current_registers, now):
+                if state.mode == MODE_HANDSHAKE:
+                    state.ack_pending = state.ack_value
+                capture = Capture(state.output, plc, state.category, current_registers,
+                                  capture_time, trigger_ns, data_ns)
+                if state.decoder is not None:
+                    capture.tag_values = state.decoder.decode(current_registers)
+                captures.append(capture)
+        return captures
+
+    def window_captures(self, plc, state, samples, trigger_ns, data_ns):
+        """One Capture per sample of a trigger window, numbered relative to the edge sample."""
+        captures = []
+        edge_index = len(samples) - 1 - state.post_samples
+        for index, (sample_time, trigger_value, registers) in enumerate(samples):
+            capture = Capture(state.output, plc, state.category, registers, sample_time, trigger_ns, data_ns)
+            capture.window = (index - edge_index, trigger_value)
+            if state.decoder is not None:
+                capture.tag_values = state.decoder.decode(registers)
+            captures.append(capture)
+        return captures
+
+    def emit(self, capture):
+        """Hand a capture to the sink and record its latency so far."""
+        capture.enqueued()
+        self.sink.write(capture)
+        METRICS.inc("mtcp_captures_total", plc=capture.plc["line_name"], output=capture.output.get("file_name", ""))
+        if self.latency is not None:
+            self.latency.record_captured(capture)
+
+    def apply_configs(self):
+        """
+        Bring the pollers in line with `plc_configs` and `outputs`.
+        Pollers of removed PLCs are stopped and pollers of changed PLCs restarted. A poller whose PLC
+        is unchanged keeps its connection and gets the new outputs, keeping the trigger and dedup
+        state of the outputs that did not change. PLCs without a live poller get one.
+        """
+        wanted = {}
+        for plc in self.plc_configs:
+            # Copies, so later edits of the configuration lists are seen as changes
+            wanted.setdefault(plc_key(plc), (dict(plc), [(category, dict(output))
+                                                        for category, output in self.outputs_for(plc)]))
+
+        obsolete = []
+        for key, poller in list(self.pollers.items()):
+            plc, outputs = wanted.get(key, (None, None))
+            if plc is None or not outputs or plc != poller.plc or not self.poller_alive(poller):
+                obsolete.append(self.pollers.pop(key))
+            elif outputs != poller.outputs:
+                poller.outputs = outputs
+                self.log(f"Reloaded output configurations of PLC '{plc['line_name']}'.")
+        if obsolete:
+            self.stop_pollers(obsolete, STOP_TIMEOUT)
+
+        for key, (plc, outputs) in wanted.items():
+            if key not in self.pollers and outputs:
+                poller = Poller(plc, outputs)
+                self.pollers[key] = poller
+                self.start_poller(poller)
+
+    def start(self):
+        """Start monitoring in the background; does nothing if it is already started."""
+        with self.lifecycle_lock:
+            if self.started:
+                return
+            self.started = True
+            self.apply_configs()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stop every poller and wait up to `timeout` seconds for them; does nothing if not started."""
+        with self.lifecycle_lock:
+            if not self.started:
+                return
+            self.started = False
+            pollers = list(self.pollers.values())
+            self.pollers = {}
+            self.stop_pollers(pollers, timeout)
+
+    def reload(self, plc_configs, outputs):
+        """Switch to new configurations; while monitoring, only the affected pollers are touched."""
+        with self.lifecycle_lock:
+            self.plc_configs = plc_configs
+            self.outputs = outputs
+            if self.started:
+                self.apply_configs()
+
+    def start_poller(self, poller):
+        raise NotImplementedError
+
+    def stop_pollers(self, pollers, timeout):
+        raise NotImplementedError
+
+    def poller_alive(self, poller):
+        raise NotImplementedError
+
+    def is_running(self):
+        """Return True while any poller is alive."""
+        return any(self.poller_alive(poller) for poller in list(self.pollers.values()))
+
+    def run(self):
+        """Monitor in the calling thread until every poller has stopped."""
+        raise NotImplementedError
+
+
+class ThreadedEngine(MonitoringEngine):
+    """
+    Each PLC gets one thread and one Modbus connection, shared with the other units behind the
+    same gateway; the trigger and data reads of all its outputs are coalesced into as few requests
+    as possible (see PollPlan).
+    """
+
+    session_class = PLCSession
+
+    def read_blocks(self, session, blocks, results):
+        for block in blocks:
+            if block not in results:
+                results[block] = session.read(block.register_type, block.start, block.count)
+
+    def poll_cycle(self, session, plc, plan, scheduler, states, budget=None):
+        """Run one poll cycle for the due outputs of a single PLC, within its request budget."""
+        results = {}
+        paid = set()
+        states = self.admit(plc, budget, plan, scheduler, states, paid, time.monotonic())
+        self.read_blocks(session, plan.trigger_blocks(states), results)
+        trigger_ns = time.monotonic_ns()
+        capture_time = time.time()
+        fired = self.collect_triggers(plc, plan, states, results)
+
+        if fired:
+            # Read register data only on the OFF -> ON transition of a trigger
+            self.spend_data(budget, plan, fired, paid)
+            self.read_blocks(session, plan.data_blocks(fired), results)
+
+            # Write **only if data has changed** since the last logged state
+            for capture in self.collect_data(plc, plan, fired, results, capture_time, trigger_ns):
+                self.emit(capture)
+
+        # Acknowledge handshake captures once they are handed to the sinks
+        for state in self.acknowledgements(states):
+            if session.write(state.ack_type, state.ack_register, state.ack_pending):
+                state.acknowledged(state.ack_pending)
+            else:
+                self.acknowledge_failed(plc, state)
+
+        self.report_read_failures(plc, plan, scheduler, states, results)
+
+    def process_registers(self, poller):
+        """
+        Continuously monitor every output configuration of a single PLC over one shared connection,
+        until the poller is stopped.
+        A lost connection is re-established with backoff; the trigger and dedup state of the outputs
+        is kept, so polling resumes where it stopped.
+        """
+        plc, outputs, stopping = poller.plc, poller.outputs, poller.stopping
+        plan = self.build_plan(plc, outputs)
+        scheduler = PollScheduler(plan.states, time.monotonic())
+        breaker = self.create_breaker(plc)
+        budget = self.create_budget(plc, plan, time.monotonic())
+        session = self.open_session(plc)
+        try:
+            while plan.states and not stopping.is_set():
+                try:
+                    if not session.connect():
+                        raise ConnectionError("connection failed")
+                    scheduler.resume(time.monotonic())
+                    while plan.states and not stopping.is_set():  # Continuous monitoring loop
+                        if poller.outputs is not outputs:
+                            # Configuration reloaded: keep the connection, rebuild the plan
+                            outputs = poller.outputs
+                            plan = self.build_plan(plc, outputs, plan.states)
+                            scheduler = PollScheduler(plan.states, time.monotonic())
+                            budget = self.create_budget(plc, plan, time.monotonic())
+                            continue
+                        # Sleep until the next output is due
+                        delay = scheduler.next_deadline() - time.monotonic()
+                        if delay > 0 and stopping.wait(delay):
+                            break
+                        now = time.monotonic()
+                        self.poll_cycle(session, plc, plan, scheduler, scheduler.due(now), budget)
+                        if breaker.failures:
+                            self.connection_restored(plc, breaker)
+                        self.report_overruns(plc, scheduler, now)
+                        self.report_shed(plc, budget, now)
+
+                except Exception as e:
+                    session.close(e)
+                    if not stopping.is_set():
+                        stopping.wait(self.connection_failed(plc, breaker, e))
+                        breaker.probe()
+        finally:
+            self.sessions.release(session)
+
+    def start_poller(self, poller):
+        poller.worker = threading.Thread(target=self.process_registers, args=(poller,), daemon=True)
+        poller.worker.start()
+
+    def stop_pollers(self, pollers, timeout):
+        for poller in pollers:
+            poller.stopping.set()
+        deadline = time.monotonic() + timeout
+        for poller in pollers:
+            poller.worker.join(max(0.0, deadline - time.monotonic()))
+            if poller.worker.is_alive():
+                self.log(f"Poller of PLC '{poller.plc['line_name']}' did not stop within {timeout:g} s.")
+
+    def poller_alive(self, poller):
+        return poller.worker is not None and poller.worker.is_alive()
+
+    def run(self):
+        self.start()
+        while True:
+            threads = [poller.worker for poller in list(self.pollers.values()) if self.poller_alive(poller)]
+            if not threads:
+                break
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,132 @@
+"""
+Trigger-to-capture latency histograms per PLC and output.
+"""
+import bisect
+import json
+import math
+import threading
+
+# Histogram buckets: upper bounds in nanoseconds, about 19% apart from 10 us to 100 s
+BUCKET_BOUNDS = [int(10_000 * 2 ** (i / 4)) for i in range(int(4 * math.log2(1e7)) + 2)]
+
+# Stages measured from the moment the trigger edge was observed
+STAGE_DATA_READ = "data_read"
+STAGE_ENQUEUED = "enqueued"
+STAGE_PERSISTED = "persisted"
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of latencies in nanoseconds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of the samples (never above the maximum)."""
+        if not self.count:
+            return 0
+        rank = math.ceil(fraction * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[index], self.max)
+                return self.max
+        return self.max
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        return histogram
+
+    def merge(self, other):
+        """Add the samples of another histogram."""
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        """p50/p99/max and mean in milliseconds."""
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(0.5) / 1e6,
+            "p99_ms": self.percentile(0.99) / 1e6,
+            "max_ms": self.max / 1e6,
+            "mean_ms": (self.total / self.count / 1e6) if self.count else 0.0,
+        }
+
+
+class LatencyRecorder:
+    """
+    Thread-safe latency histograms keyed by (line name, output file name, stage).
+    Every stage is measured from the moment the trigger edge was observed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def add(self, capture, stage, stage_ns):
+        key = (capture.plc["line_name"], capture.output.get("file_name", ""), stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(stage_ns - capture.trigger_ns)
+
+    def record_captured(self, capture):
+        """Record the data read and enqueue stages of a capture handed to the sinks."""
+        self.add(capture, STAGE_DATA_READ, capture.data_ns)
+        self.add(capture, STAGE_ENQUEUED, capture.enqueued_ns)
+
+    def record_persisted(self, captures, sink_name, persisted_ns):
+        """Record that `captures` were written by the sink called `sink_name`."""
+        stage = f"{STAGE_PERSISTED}_{sink_name}"
+        for capture in captures:
+            self.add(capture, stage, persisted_ns)
+
+    def histogram_items(self):
+        """Return [((line name, file name, stage), histogram)] with copies of the histograms."""
+        with self.lock:
+            return [(key, histogram.copy()) for key, histogram in sorted(self.histograms.items())]
+
+    def summaries(self):
+        """Return [(line name, file name, stage, summary)] sorted by PLC, output and stage."""
+        with self.lock:
+            items = sorted(self.histograms.items())
+            return [(line_name, file_name, stage, histogram.summary())
+                    for (line_name, file_name, stage), histogram in items]
+
+    def stage_summaries(self):
+        """Return {stage: summary} over every PLC and output."""
+        stages = {}
+        for (_, _, stage), histogram in self.histogram_items():
+            if stage in stages:
+                stages[stage].merge(histogram)
+            else:
+                stages[stage] = histogram
+        return {stage: histogram.summary() for stage, histogram in sorted(stages.items())}
+
+    def dump(self, path):
+        """Write the histogram summaries to a JSON file."""
+        data = [
+            {"line_name": line_name, "file_name": file_name, "stage": stage, **summary}
+            for line_name, file_name, stage, summary in self.summaries()
+        ]
+        with open(path, "w") as file:
+            json.dump(data, file, indent=4)
@@ -0,0 +1,61 @@
+"""
+Bounded message pipeline between the monitoring engine threads and a GUI.
+"""
+import collections
+import re
+
+# Default number of recent lines kept for display
+LOG_MAX_LINES = 200
+
+# Messages waiting for the GUI beyond this are dropped, oldest first
+LOG_MAX_PENDING = 10000
+
+# Sink messages whose row counts are added up when coalesced
+ROWS_WRITTEN = re.compile(r"^Written (?P<count>\d+) row\(s\) (?P<target>.*)$")
+
+
+class LogPipeline:
+    """
+    Engine threads post() messages; the GUI thread calls drain() at its own refresh rate.
+    Posting only appends to a deque, which is atomic in CPython, so workers never take a lock
+    or touch a widget. drain() coalesces the messages of one refresh (repeated messages become
+    one line with a count, row counts of the same PLC and file are added up) and keeps only the
+    last `max_lines` lines.
+    """
+
+    def __init__(self, max_lines=LOG_MAX_LINES, max_pending=LOG_MAX_PENDING):
+        self.pending = collections.deque(maxlen=max_pending)
+        self.lines = collections.deque(maxlen=max_lines)
+
+    def post(self, message):
+        """Queue a message from any thread."""
+        self.pending.append(message)
+
+    def drain(self):
+        """Move the pending messages into the line buffer; returns True if lines were added."""
+        counts = {}  # Insertion-ordered: coalesced lines keep the order of their first message
+        while True:
+            try:
+                message = self.pending.popleft()
+            except IndexError:
+                break
+            match = ROWS_WRITTEN.match(message)
+            if match:
+                key = ("rows", match.group("target"))
+                counts[key] = counts.get(key, 0) + int(match.group("count"))
+            else:
+                key = ("message", message)
+                counts[key] = counts.get(key, 0) + 1
+
+        for (kind, text), count in counts.items():
+            if kind == "rows":
+                self.lines.append(f"Written {count} row(s) {text}")
+            elif count > 1:
+                self.lines.append(f"{text} (x{count})")
+            else:
+                self.lines.append(text)
+        return bool(counts)
+
+    def text(self):
+        """Return the buffered lines as one string."""
+        return "\n".join(self.lines)
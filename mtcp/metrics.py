@@ -0,0 +1,157 @@
+"""
+Engine metrics and an optional local HTTP endpoint serving them in Prometheus text format.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mtcp.latency import BUCKET_BOUNDS
+
+# (type, help) of every metric the engine exposes
+METRIC_DESCRIPTIONS = {
+    "mtcp_modbus_requests_total": ("counter", "Modbus requests sent, per PLC and function code."),
+    "mtcp_modbus_bytes_read_total": ("counter", "Payload bytes read from the PLC."),
+    "mtcp_modbus_read_errors_total": ("counter", "Modbus reads that failed or returned an exception response."),
+    "mtcp_modbus_write_errors_total": ("counter", "Modbus writes (handshake acknowledgements) that failed."),
+    "mtcp_modbus_connections_total": ("counter", "Connections opened to the PLC."),
+    "mtcp_modbus_reconnects_total": ("counter", "Connections re-established to the PLC."),
+    "mtcp_plc_circuit_open": ("gauge", "1 while the circuit breaker of the PLC is open."),
+    "mtcp_captures_total": ("counter", "Snapshots captured and handed to the sinks."),
+    "mtcp_missed_events_total": ("counter", "Increments of a sequence-counter trigger skipped between two polls."),
+    "mtcp_requests_shed_total": ("counter", "Modbus requests postponed because the PLC was at its request budget."),
+    "mtcp_poll_overruns_total": ("counter", "Poll slots skipped because a cycle missed its deadline."),
+    "mtcp_sink_rows_written_total": ("counter", "Rows written by each sink."),
+    "mtcp_sink_errors_total": ("counter", "Captures a sink dropped after an unexpected error in its writer."),
+    "mtcp_sink_queue_depth": ("gauge", "Captures waiting in the queue of each sink."),
+    "mtcp_sink_spool_bytes": ("gauge", "Bytes in the disk spool of each sink not yet made durable at its destination."),
+    "mtcp_capture_latency_seconds": ("histogram", "Latency from trigger observed to each capture stage."),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + text + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and gauges keyed by metric name and labels.
+    Gauges are callables evaluated when the metrics are rendered; latency histograms are read
+    from the attached LatencyRecorder.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> callable returning the current value
+        self.latency = None
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def total(self, name):
+        """Return the sum of a counter over all its labels."""
+        with self.lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def counter_values(self):
+        """Return a copy of every counter as {(name, labels): value}."""
+        with self.lock:
+            return dict(self.counters)
+
+    def gauge_values(self):
+        """Return the current value of every gauge as {(name, labels): value}."""
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, function in gauges:
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return values
+
+    def gauge(self, name, function, **labels):
+        """Register a gauge whose value is `function()` at render time."""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = function
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format."""
+        with self.lock:
+            samples = {}
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((labels, value))
+        for (name, labels), value in self.gauge_values().items():
+            samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = METRIC_DESCRIPTIONS.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples[name]):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+        if self.latency is not None:
+            lines.extend(self.render_latency())
+        return "\n".join(lines) + "\n"
+
+    def render_latency(self):
+        name = "mtcp_capture_latency_seconds"
+        kind, description = METRIC_DESCRIPTIONS[name]
+        lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for (line_name, file_name, stage), histogram in self.latency.histogram_items():
+            labels = (("output", file_name), ("plc", line_name), ("stage", stage))
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound / 1e9:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.total / 1e9}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return lines
+
+
+# Registry shared by the sessions, engines and sinks of this process
+METRICS = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line
+
+
+class MetricsServer:
+    """Serve `metrics` at http://host:port/metrics from a background thread."""
+
+    def __init__(self, port, host="127.0.0.1", metrics=METRICS):
+        handler = type("Handler", (MetricsRequestHandler,), {"metrics": metrics})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
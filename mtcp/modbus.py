@@ -0,0 +1,389 @@
+"""
+Modbus TCP sessions: one long-lived connection per PLC address, shared by all of its pollers and,
+behind a Modbus TCP/RTU gateway, by every unit ID the gateway serves.
+"""
+import asyncio
+import inspect
+import threading
+from array import array
+
+from pymodbus.client import ModbusTcpClient, AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusIOException
+
+from mtcp.metrics import METRICS
+
+# Modbus read function for each register type
+READ_FUNCTIONS = {
+    "Coil": "read_coils",
+    "Discrete": "read_discrete_inputs",
+    "Holding": "read_holding_registers",
+    "Input": "read_input_registers",
+}
+
+# Modbus function code of each read function
+FUNCTION_CODES = {
+    "Coil": 1,
+    "Discrete": 2,
+    "Holding": 3,
+    "Input": 4,
+}
+
+# Modbus single write function and its function code for each writable register type
+WRITE_FUNCTIONS = {
+    "Coil": ("write_coil", 5),
+    "Holding": ("write_register", 6),
+}
+
+# Protocol limit on the number of values a single read request may return
+MAX_READ_COUNT = {
+    "Coil": 2000,
+    "Discrete": 2000,
+    "Holding": 125,
+    "Input": 125,
+}
+
+# Default number of unused registers/bits a merged read may bridge between two spans
+READ_GAP_FILL = 8
+
+# Unit ID of a PLC configuration without `unit_id`
+DEFAULT_UNIT_ID = 1
+
+# array typecodes of the values read: unsigned 16-bit registers, and bits as 0/1 bytes
+REGISTER_TYPECODE = "H"
+BIT_TYPECODE = "B"
+
+
+def unit_keyword(client_class):
+    """Keyword argument carrying the unit ID of a request: `device_id` since pymodbus 3.10, `slave` before."""
+    parameters = inspect.signature(client_class.read_holding_registers).parameters
+    return "device_id" if "device_id" in parameters else "slave"
+
+
+# Unit ID keyword of the installed pymodbus release
+UNIT_KEYWORD = unit_keyword(ModbusTcpClient)
+
+
+def unit_argument(plc):
+    """Keyword arguments addressing a request to the unit of `plc`."""
+    return {UNIT_KEYWORD: unit_id(plc)}
+
+
+def gateway_key(plc):
+    """Address of the connection a PLC is reached over; PLCs with the same one share it."""
+    return (plc["ip_address"], str(plc["port"]))
+
+
+def unit_id(plc):
+    """Modbus unit ID of a PLC configuration."""
+    return int(plc.get("unit_id", DEFAULT_UNIT_ID))
+
+
+def read_chunks(register_type, address, count):
+    """Split a read of `count` values into (address, count) requests that fit MAX_READ_COUNT."""
+    limit = MAX_READ_COUNT[register_type]
+    end = address + count
+    return [(chunk_address, min(limit, end - chunk_address)) for chunk_address in range(address, end, limit)]
+
+
+def new_values(register_type):
+    """Return an empty compact buffer for values of `register_type`."""
+    if register_type in ["Coil", "Discrete"]:
+        return array(BIT_TYPECODE)
+    return array(REGISTER_TYPECODE)
+
+
+def response_values(register_type, response, count):
+    """Return the values carried by a read response."""
+    if register_type in ["Coil", "Discrete"]:
+        return response.bits[:count]
+    return response.registers
+
+
+def count_request(plc, register_type, count, failed):
+    """Update the request metrics of one read of `count` values."""
+    line_name = plc["line_name"]
+    METRICS.inc("mtcp_modbus_requests_total", plc=line_name, function=FUNCTION_CODES[register_type])
+    if failed:
+        METRICS.inc("mtcp_modbus_read_errors_total", plc=line_name)
+    elif register_type in ["Coil", "Discrete"]:
+        METRICS.inc("mtcp_modbus_bytes_read_total", (count + 7) // 8, plc=line_name)
+    else:
+        METRICS.inc("mtcp_modbus_bytes_read_total", 2 * count, plc=line_name)
+
+
+def count_write(plc, register_type, failed):
+    """Update the request metrics of one single-value write."""
+    METRICS.inc("mtcp_modbus_requests_total", plc=plc["line_name"], function=WRITE_FUNCTIONS[register_type][1])
+    if failed:
+        METRICS.inc("mtcp_modbus_write_errors_total", plc=plc["line_name"])
+
+
+def write_value(register_type, value):
+    """The value sent by a write: coils take a boolean."""
+    return bool(value) if register_type == "Coil" else int(value)
+
+
+def client_options(timeout):
+    """Keyword arguments of a pymodbus client with an optional response `timeout` in seconds."""
+    return {} if timeout is None else {"timeout": timeout}
+
+
+class FairLock:
+    """
+    Lock granted in the order it was requested, so the pollers of the units sharing a gateway
+    connection take turns instead of one of them winning every race for it.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+
+    def __enter__(self):
+        with self.condition:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while ticket != self.serving:
+                self.condition.wait()
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.serving += 1
+            self.condition.notify_all()
+
+
+class PLCSession:
+    """
+    One long-lived Modbus TCP connection to a PLC address.
+    Every output configuration polled on the PLC shares it, and so does every unit behind the same
+    gateway (see SessionPool); requests are serialized with a fair lock and carry the unit ID of
+    the PLC (`plc`) they are made for.
+    """
+
+    def __init__(self, plc, timeout=None):
+        self.plc = plc
+        self.client = ModbusTcpClient(plc["ip_address"], port=int(plc["port"]), **client_options(timeout))
+        self.lock = FairLock()
+        self.connections = 0
+        self.users = 0  # PLCs polled over this connection
+
+    def connect(self, plc=None):
+        """Open the connection if it is not open yet."""
+        plc = plc or self.plc
+        with self.lock:
+            if self.client.is_socket_open():
+                return True
+            connected = self.client.connect()
+            if connected:
+                self.connections += 1
+                METRICS.inc("mtcp_modbus_connections_total", plc=plc["line_name"])
+                if self.connections > 1:
+                    METRICS.inc("mtcp_modbus_reconnects_total", plc=plc["line_name"])
+            return connected
+
+    def read(self, register_type, address, count, plc=None):
+        """
+        Read `count` values of `register_type` starting at `address`.
+        Ranges above the protocol limit are read in chunks back to back without releasing the lock,
+        and reassembled into one list.
+        Returns the values as an array (see new_values), or None if the PLC answered with an error.
+        """
+        plc = plc or self.plc
+        function_name = READ_FUNCTIONS.get(register_type)
+        if function_name is None:
+            raise ValueError(f"Unsupported register type: '{register_type}'")
+
+        values = new_values(register_type)
+        with self.lock:
+            read_function = getattr(self.client, function_name)
+            for chunk_address, chunk_count in read_chunks(register_type, address, count):
+                try:
+                    response = read_function(address=chunk_address, count=chunk_count, **unit_argument(plc))
+                except Exception:
+                    count_request(plc, register_type, chunk_count, True)
+                    raise
+                count_request(plc, register_type, chunk_count, response.isError())
+                if response.isError():
+                    return None
+                values.extend(response_values(register_type, response, chunk_count))
+        return values
+
+    def write(self, register_type, address, value, plc=None):
+        """Write one coil or holding register; returns False if the PLC answered with an error."""
+        plc = plc or self.plc
+        function_name = WRITE_FUNCTIONS[register_type][0]
+        with self.lock:
+            try:
+                response = getattr(self.client, function_name)(address=address, value=write_value(register_type, value),
+                                                               **unit_argument(plc))
+            except Exception:
+                count_write(plc, register_type, True)
+                raise
+        count_write(plc, register_type, response.isError())
+        return not response.isError()
+
+    def close(self):
+        """Close the connection."""
+        with self.lock:
+            if self.client.is_socket_open():
+                self.client.close()
+
+
+class AsyncPLCSession:
+    """
+    asyncio counterpart of PLCSession built on AsyncModbusTcpClient.
+    Requests from concurrent coroutines share the one connection. A connection used by a single PLC
+    pipelines them; a gateway connection shared by several units sends one request at a time, in
+    the order they were made (asyncio.Lock is fair), and applies each unit's `timeout_s`.
+    """
+
+    def __init__(self, plc, timeout=None):
+        self.plc = plc
+        self.client = AsyncModbusTcpClient(plc["ip_address"], port=int(plc["port"]), **client_options(timeout))
+        self.lock = asyncio.Lock()
+        self.connections = 0
+        self.users = 0  # PLCs polled over this connection
+
+    async def connect(self, plc=None):
+        """Open the connection if it is not open yet."""
+        plc = plc or self.plc
+        if self.client.connected:
+            return True
+        connected = await self.client.connect()
+        if connected:
+            self.connections += 1
+            METRICS.inc("mtcp_modbus_connections_total", plc=plc["line_name"])
+            if self.connections > 1:
+                METRICS.inc("mtcp_modbus_reconnects_total", plc=plc["line_name"])
+        return connected
+
+    async def request(self, plc, function, **kwargs):
+        """Send one request for `plc`, with its unit ID and, on a shared connection, its turn and timeout."""
+        if self.users <= 1:
+            return await function(**unit_argument(plc), **kwargs)
+        timeout = plc.get("timeout_s")
+        async with self.lock:
+            return await asyncio.wait_for(function(**unit_argument(plc), **kwargs),
+                                          None if timeout is None else float(timeout))
+
+    async def read(self, register_type, address, count, plc=None):
+        """
+        Read `count` values of `register_type` starting at `address`.
+        Ranges above the protocol limit are split into chunks that are sent together as pipelined
+        requests (one transaction ID each), so the whole range costs about one round trip.
+        Returns the reassembled values as an array (see new_values), or None if the PLC answered with an error.
+        """
+        plc = plc or self.plc
+        function_name = READ_FUNCTIONS.get(register_type)
+        if function_name is None:
+            raise ValueError(f"Unsupported register type: '{register_type}'")
+
+        read_function = getattr(self.client, function_name)
+        chunks = read_chunks(register_type, address, count)
+        responses = await asyncio.gather(
+            *(self.request(plc, read_function, address=chunk_address, count=chunk_count)
+              for chunk_address, chunk_count in chunks),
+            return_exceptions=True
+        )
+
+        values = new_values(register_type)
+        for response, (_, chunk_count) in zip(responses, chunks):
+            failed = isinstance(response, Exception) or response.isError()
+            count_request(plc, register_type, chunk_count, failed)
+        for response, (_, chunk_count) in zip(responses, chunks):
+            if isinstance(response, Exception):
+                raise response
+            if response.isError():
+                return None
+            values.extend(response_values(register_type, response, chunk_count))
+        return values
+
+    async def write(self, register_type, address, value, plc=None):
+        """Write one coil or holding register; returns False if the PLC answered with an error."""
+        plc = plc or self.plc
+        function_name = WRITE_FUNCTIONS[register_type][0]
+        try:
+            response = await self.request(plc, getattr(self.client, function_name),
+                                          address=address, value=write_value(register_type, value))
+        except Exception:
+            count_write(plc, register_type, True)
+            raise
+        count_write(plc, register_type, response.isError())
+        return not response.isError()
+
+    def close(self):
+        """Close the connection."""
+        self.client.close()
+
+
+class ReadFailure(Exception):
+    """
+    Every read of a poll cycle was answered with an error, for instance by a gateway whose unit does not
+    respond (exception 0x0B) or, on older pymodbus releases, by a client whose request timed out.
+    """
+
+
+def is_response_timeout(error):
+    """Return True if `error` is a unit not answering in time, rather than a broken connection."""
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, ModbusIOException, ReadFailure))
+
+
+class UnitSession:
+    """
+    The session of one PLC: its unit ID and metric labels on a connection that may be shared.
+    Works over PLCSession and AsyncPLCSession alike; with the latter its methods return coroutines.
+    """
+
+    def __init__(self, session, plc):
+        self.session = session
+        self.plc = plc
+
+    def connect(self):
+        return self.session.connect(self.plc)
+
+    def read(self, register_type, address, count):
+        return self.session.read(register_type, address, count, self.plc)
+
+    def write(self, register_type, address, value):
+        return self.session.write(register_type, address, value, self.plc)
+
+    def close(self, error=None):
+        """
+        Close the connection after `error`, unless it is a unit's response timeout on a connection other
+        units use: a device that stops answering behind a gateway must not cut off the others.
+        """
+        if self.session.users <= 1 or not is_response_timeout(error):
+            self.session.close()
+
+
+class SessionPool:
+    """
+    The connections of an engine, one per PLC address (see gateway_key). PLCs behind the same
+    gateway share its connection, so a gateway serving 30 units needs a single TCP session.
+    """
+
+    def __init__(self, session_class):
+        self.session_class = session_class
+        self.sessions = {}  # gateway_key -> session
+        self.lock = threading.Lock()
+
+    def open(self, plc, timeout=None):
+        """Return the UnitSession of `plc`; a new connection gets the response `timeout` in seconds."""
+        with self.lock:
+            session = self.sessions.get(gateway_key(plc))
+            if session is None:
+                session = self.session_class(plc, timeout)
+                self.sessions[gateway_key(plc)] = session
+            session.users += 1
+        return UnitSession(session, plc)
+
+    def release(self, unit_session):
+        """Give a UnitSession back; the connection is closed when its last PLC is released."""
+        with self.lock:
+            session = unit_session.session
+            session.users -= 1
+            if session.users > 0:
+                return
+            if self.sessions.get(gateway_key(session.plc)) is session:
+                del self.sessions[gateway_key(session.plc)]
+        session.close()
@@ -0,0 +1,167 @@
+"""
+Read-coalescing planner: merges the trigger and data spans of a PLC into minimal Modbus requests.
+"""
+from mtcp.modbus import MAX_READ_COUNT, READ_GAP_FILL, read_chunks
+from mtcp.supervise import Backoff
+
+# Delay before the spans of a failed merged read are merged again, doubled after every failure up to
+# REMERGE_MAX_DELAY
+REMERGE_BASE_DELAY = 10.0
+REMERGE_MAX_DELAY = 600.0
+
+
+class ReadBlock:
+    """One contiguous Modbus read request covering one or more requested spans."""
+
+    def __init__(self, register_type, start, count):
+        self.register_type = register_type
+        self.start = start
+        self.count = count
+        self.spans = []
+
+    @property
+    def end(self):
+        return self.start + self.count
+
+    @property
+    def requests(self):
+        """Number of Modbus requests reading the block takes."""
+        return len(read_chunks(self.register_type, self.start, self.count))
+
+    def extract(self, values, span):
+        """Return the part of this block's `values` that belongs to `span`."""
+        offset = span[1] - self.start
+        return values[offset:offset + span[2]]
+
+
+def plan_reads(spans, gap_fill=READ_GAP_FILL, isolated=()):
+    """
+    Coalesce (register_type, address, count) spans into as few contiguous reads as possible.
+    Spans of the same register type are merged when the hole between them is at most `gap_fill`
+    and the merged read stays within MAX_READ_COUNT. Spans listed in `isolated` always get a read of their own.
+    Returns a dictionary mapping every span to the ReadBlock that covers it.
+    """
+    blocks = {}
+    spans_by_type = {}
+    for span in set(spans):
+        if span in isolated:
+            block = ReadBlock(*span)
+            block.spans.append(span)
+            blocks[span] = block
+        else:
+            spans_by_type.setdefault(span[0], []).append(span)
+
+    for register_type, type_spans in spans_by_type.items():
+        limit = MAX_READ_COUNT[register_type]
+        block = None
+        for span in sorted(type_spans, key=lambda item: (item[1], item[2])):
+            _, address, count = span
+            new_end = max(block.end, address + count) if block else 0
+            if block is not None and address <= block.end + gap_fill and new_end - block.start <= limit:
+                block.count = new_end - block.start
+            else:
+                block = ReadBlock(register_type, address, count)
+            block.spans.append(span)
+            blocks[span] = block
+
+    return blocks
+
+
+class PollPlan:
+    """
+    Read plan for the outputs of one PLC, built once at monitoring start.
+    Every trigger address and data range is coalesced per register type, so a poll cycle
+    needs one round trip per trigger block of the due outputs plus, on a trigger edge, one per data block.
+    """
+
+    def __init__(self, states, gap_fill=READ_GAP_FILL):
+        self.states = list(states)
+        self.gap_fill = gap_fill
+        self.isolated = set()  # Spans read on their own since a merged read of them failed
+        self.faulty = set()  # Spans whose own read failed last time
+        self.remerge_backoff = Backoff(REMERGE_BASE_DELAY, REMERGE_MAX_DELAY)
+        self.remerge_at = None
+        self.build()
+
+    def build(self):
+        """(Re)compute the read blocks for the current set of outputs."""
+        spans = [state.trigger_span for state in self.states if state.trigger_span is not None]
+        spans += [state.data_span for state in self.states]
+        self.blocks = plan_reads(spans, self.gap_fill, self.isolated)
+
+    def trigger_blocks(self, states):
+        """Blocks holding the trigger registers of `states`."""
+        return self.unique_blocks(state.trigger_span for state in states if state.trigger_span is not None)
+
+    def data_blocks(self, states):
+        """Blocks holding the data ranges of `states`."""
+        return self.unique_blocks(state.data_span for state in states)
+
+    def output_blocks(self, states):
+        """Blocks holding the trigger registers and data ranges of `states`."""
+        return self.unique_blocks(span for state in states for span in (state.trigger_span, state.data_span)
+                                  if span is not None)
+
+    def unique_blocks(self, spans):
+        blocks = []
+        for span in spans:
+            block = self.blocks[span]
+            if block not in blocks:
+                blocks.append(block)
+        return blocks
+
+    def span_values(self, span, results):
+        """Return the values of `span` from the blocks read this cycle, or None if its read failed."""
+        block = self.blocks[span]
+        values = results.get(block)
+        if values is None:
+            return None
+        return block.extract(values, span)
+
+    def handle_failures(self, results, now):
+        """
+        Deal with the blocks whose read failed this cycle.
+        A merged block is split so its spans are read separately until remerge() merges them again.
+        Returns (number of blocks split, list of (state, description) of the outputs whose own read failed).
+        """
+        failed = [block for block, values in results.items() if not values]
+        for block, values in results.items():
+            if values:
+                self.faulty.difference_update(block.spans)
+        split = 0
+        failures = []
+        for block in failed:
+            if len(block.spans) > 1:
+                self.isolated.update(block.spans)
+                split += 1
+                continue
+            span = block.spans[0]
+            self.faulty.add(span)
+            for state in self.states:
+                if span == state.trigger_span:
+                    failures.append((state, "trigger register"))
+                elif span == state.data_span:
+                    failures.append((state, "registers"))
+        if split:
+            self.remerge_at = now + self.remerge_backoff.next_delay()
+            self.build()
+        return split, failures
+
+    def remerge(self, now):
+        """
+        Merge the spans split by handle_failures() again once their backoff delay is over, so a transient
+        error does not cost extra requests for good; spans whose own read still fails stay separate.
+        The delay grows with every split, so a merged read that keeps failing is retried less and less often.
+        Returns True if fewer reads are needed afterwards.
+        """
+        if self.remerge_at is None or now < self.remerge_at:
+            return False
+        isolated = self.isolated & self.faulty
+        # Spans still failing on their own get another chance once they read again
+        self.remerge_at = now + self.remerge_backoff.next_delay() if isolated else None
+        if isolated == self.isolated:
+            return False
+        blocks = len(set(self.blocks.values()))
+        self.isolated = isolated
+        self.build()
+        return len(set(self.blocks.values())) < blocks
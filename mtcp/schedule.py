@@ -0,0 +1,112 @@
+"""
+Deadline-based poll scheduling for the outputs of one PLC.
+"""
+import random
+
+from mtcp.supervise import Backoff
+
+# Default poll period of an output in milliseconds
+POLL_INTERVAL_MS = 100
+
+# Minimum number of seconds between two overrun reports of the same PLC
+OVERRUN_REPORT_INTERVAL = 10.0
+
+
+class PollGroup:
+    """The outputs of one PLC that share a poll interval; they are polled (and their reads coalesced) together."""
+
+    def __init__(self, interval, states, first_deadline):
+        self.interval = interval
+        self.states = states
+        self.deadline = first_deadline
+
+
+class PollScheduler:
+    """
+    Monotonic deadline scheduler for the outputs of one PLC.
+    Outputs are grouped by their `poll_interval_ms`; every group fires at
+    phase + k * interval on the monotonic clock, so the period does not drift with the time spent
+    reading. The phase of each group is a random offset within its interval, which spreads the
+    pollers of many PLCs instead of firing them all at the same moment.
+    A group that falls a whole interval or more behind skips the missed slots and counts them in `overruns`.
+    An output whose read failed is suspended, left out of its group's polls for a jittered backoff delay.
+    An output the request budget cannot pay yet is deferred, polled on its own once the budget allows it.
+    """
+
+    def __init__(self, states, now):
+        intervals = {}
+        for state in states:
+            intervals.setdefault(state.poll_interval, []).append(state)
+        self.groups = [
+            PollGroup(interval, group_states, now + random.uniform(0, interval))
+            for interval, group_states in sorted(intervals.items())
+        ]
+        self.overruns = 0
+        self.exported_overruns = 0  # Overruns already added to the metrics
+        self.reported_overruns = 0
+        self.last_report = now
+        self.suspended = {}  # state -> monotonic time it is polled again
+        self.backoffs = {}  # state -> Backoff of its failed reads
+        self.deferred = {}  # state -> monotonic time its postponed poll is due
+
+    def next_deadline(self):
+        """Monotonic time at which the next group or deferred output is due."""
+        return min([group.deadline for group in self.groups] + list(self.deferred.values()))
+
+    def due(self, now):
+        """Return the outputs due at `now` and advance the deadlines of their groups."""
+        states = []
+        for group in self.groups:
+            if group.deadline > now:
+                continue
+            states.extend(group.states)
+            group.deadline += group.interval
+            if group.deadline <= now:
+                missed = int((now - group.deadline) // group.interval) + 1
+                group.deadline += missed * group.interval
+                self.overruns += missed
+        for state, until in list(self.deferred.items()):
+            if until <= now:
+                del self.deferred[state]
+                if state not in states:
+                    states.append(state)
+        if self.suspended:
+            states = [state for state in states if self.suspended.get(state, now) <= now]
+            self.suspended = {state: until for state, until in self.suspended.items() if until > now}
+        return states
+
+    def resume(self, now):
+        """
+        Restart every group from `now` after a pause such as a reconnect, without counting the gap as
+        overruns; suspended outputs are polled again right away.
+        """
+        for group in self.groups:
+            group.deadline = now + random.uniform(0, group.interval)
+        self.suspended = {}
+        self.deferred = {}
+
+    def suspend(self, state, now):
+        """Leave out an output whose read failed for the next delay of its backoff; returns the delay."""
+        delay = self.backoffs.setdefault(state, Backoff()).next_delay()
+        self.suspended[state] = now + delay
+        return delay
+
+    def defer(self, state, until):
+        """Poll an output again at monotonic time `until`, when the request budget can pay for it."""
+        self.deferred[state] = until
+
+    def recovered(self, state):
+        """Forget the backoff of an output whose reads succeed again; returns True if it had one."""
+        return self.backoffs.pop(state, None) is not None
+
+    def overrun_report(self, now):
+        """
+        Return the number of overruns since the last report, at most once per OVERRUN_REPORT_INTERVAL,
+        or 0 if there is nothing to report yet.
+        """
+        if self.overruns == self.reported_overruns or now - self.last_report < OVERRUN_REPORT_INTERVAL:
+            return 0
+        new_overruns = self.overruns - self.reported_overruns
+        self.reported_overruns = self.overruns
+        self.last_report = now
+        return new_overruns
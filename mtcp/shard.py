@@ -0,0 +1,184 @@
+"""
+Sharded execution: the PLCs are split over several worker processes, each running its own engine.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import zlib
+from functools import partial
+
+from mtcp.engine import STOP_TIMEOUT, MonitoringEngine
+from mtcp.metrics import METRICS
+from mtcp.modbus import gateway_key
+
+# Seconds between two metric updates sent by a worker
+METRICS_FORWARD_INTERVAL = 1.0
+
+
+def shard_of(plc, workers):
+    """
+    Index of the worker polling `plc`; stable across runs and reloads, so a PLC stays on its worker.
+    PLCs are placed by address, so the units behind one gateway share a worker and its connection.
+    """
+    return zlib.crc32(repr(gateway_key(plc)).encode("utf-8")) % workers
+
+
+def partition(plc_configs, workers):
+    """Split the PLC configurations into one list per worker."""
+    shards = [[] for _ in range(workers)]
+    for plc in plc_configs:
+        shards[shard_of(plc, workers)].append(plc)
+    return shards
+
+
+class ResultSink:
+    """Sink of a worker's engine: hands every capture to the parent process."""
+
+    def __init__(self, results):
+        self.results = results
+
+    def write(self, capture):
+        self.results.put(("capture", capture))
+
+    def close(self):
+        pass
+
+
+class MetricsForwarder:
+    """Send the counters of a worker as increments since the last update, and its gauges as values."""
+
+    def __init__(self, results):
+        self.results = results
+        self.sent = {}
+
+    def forward(self):
+        counters = METRICS.counter_values()
+        increments = {key: value - self.sent.get(key, 0)
+                      for key, value in counters.items() if value != self.sent.get(key, 0)}
+        self.sent = counters
+        self.results.put(("metrics", (increments, METRICS.gauge_values())))
+
+
+def run_worker(engine_name, plc_configs, outputs, results, commands):
+    """Worker process: poll `plc_configs` until told to stop, applying reloads sent by the parent."""
+    from mtcp.cli import engine_class
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops the workers
+
+    def log(message):
+        results.put(("log", message))
+
+    engine = engine_class(engine_name)(plc_configs, outputs, ResultSink(results), log)
+    forwarder = MetricsForwarder(results)
+    engine.start()
+    try:
+        while True:
+            try:
+                command = commands.get(timeout=METRICS_FORWARD_INTERVAL)
+            except queue.Empty:
+                forwarder.forward()
+                continue
+            if command[0] == "reload":
+                engine.reload(command[1], command[2])
+            elif command[0] == "stop":
+                break
+    finally:
+        engine.stop()
+        forwarder.forward()
+
+
+class ShardedEngine(MonitoringEngine):
+    """
+    Run the pollers in `workers` processes, each with its own `engine_name` engine and a share
+    of the PLCs (see shard_of), so Modbus framing, decoding and change detection scale with the cores.
+    Captures, log messages and metrics flow back over one multiprocessing queue to this process,
+    which writes the captures to its sink and records their latency.
+    """
+
+    def __init__(self, plc_configs, outputs, sink, log=print, latency=None, workers=None, engine_name="threaded"):
+        super().__init__(plc_configs, outputs, sink, log, latency)
+        self.workers = workers or os.cpu_count() or 1
+        self.engine_name = engine_name
+        self.results = None
+        self.processes = []
+        self.commands = []
+        self.receiver = None
+        self.remote_gauges = {}  # (name, labels) -> last value sent by a worker
+
+    def receive(self):
+        """Receiver thread: dispatch what the workers send until stop() ends it."""
+        while True:
+            kind, payload = self.results.get()
+            if kind == "capture":
+                self.sink.write(payload)
+                if self.latency is not None:
+                    self.latency.record_captured(payload)
+            elif kind == "log":
+                self.log(payload)
+            elif kind == "metrics":
+                self.apply_metrics(*payload)
+            elif kind == "done":
+                break
+
+    def apply_metrics(self, increments, gauges):
+        for (name, labels), amount in increments.items():
+            METRICS.inc(name, amount, **dict(labels))
+        for key, value in gauges.items():
+            if key not in self.remote_gauges:
+                METRICS.gauge(key[0], partial(self.remote_gauges.get, key, 0), **dict(key[1]))
+            self.remote_gauges[key] = value
+
+    def start(self):
+        """Start the worker processes and the receiver thread; does nothing if they are running."""
+        with self.lifecycle_lock:
+            if self.started:
+                return
+            self.started = True
+            self.results = multiprocessing.Queue()
+            self.receiver = threading.Thread(target=self.receive, daemon=True)
+            self.receiver.start()
+            self.processes = []
+            self.commands = []
+            for shard in partition(self.plc_configs, self.workers):
+                commands = multiprocessing.Queue()
+                process = multiprocessing.Process(
+                    target=run_worker, args=(self.engine_name, shard, self.outputs, self.results, commands), daemon=True
+                )
+                process.start()
+                self.processes.append(process)
+                self.commands.append(commands)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stop every worker, waiting up to `timeout` seconds before terminating it."""
+        with self.lifecycle_lock:
+            if not self.started:
+                return
+            self.started = False
+            for commands in self.commands:
+                commands.put(("stop",))
+            for process in self.processes:
+                process.join(timeout)
+                if process.is_alive():
+                    self.log(f"Worker process {process.pid} did not stop within {timeout:g} s.")
+                    process.terminate()
+            self.results.put(("done", None))
+            self.receiver.join(timeout)
+
+    def reload(self, plc_configs, outputs):
+        """Send every worker its share of the new configurations; each one restarts only the affected pollers."""
+        with self.lifecycle_lock:
+            self.plc_configs = plc_configs
+            self.outputs = outputs
+            if self.started:
+                for commands, shard in zip(self.commands, partition(plc_configs, self.workers)):
+                    commands.put(("reload", shard, outputs))
+
+    def is_running(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def run(self):
+        self.start()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,360 @@
+"""
+Output sinks for captured register data.
+"""
+import csv
+import functools
+import os
+import queue
+import threading
+import time
+
+from mtcp.metrics import METRICS
+from mtcp.spool import Spool
+from mtcp.supervise import Backoff
+from mtcp.tags import tag_names
+
+# Default number of seconds between flushes of a sink
+SINK_FLUSH_INTERVAL = 1.0
+
+# Maximum number of rows written per batch
+SINK_BATCH_SIZE = 1000
+
+
+class SinkGroup:
+    """Fan captured rows out to several sinks."""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, capture):
+        for sink in self.sinks:
+            sink.write(capture)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# Columns of the samples of a trigger window: sample number relative to the edge, trigger value
+WINDOW_COLUMNS = ["Sample", "Trigger"]
+
+
+@functools.lru_cache(maxsize=None)
+def csv_headers(register_count, window=False):
+    """Column names of a CSV file holding `register_count` registers per row (of trigger window samples)."""
+    return (["Line Name", "Equipment Name", "IP Address", "Timestamp"] + (WINDOW_COLUMNS if window else [])
+            + [f"Register_{i + 1}" for i in range(register_count)])
+
+
+@functools.lru_cache(maxsize=None)
+def csv_tag_headers(names, window=False):
+    """Column names of a CSV file holding the decoded tags `names` (a tuple) per row (of trigger window samples)."""
+    return ["Line Name", "Equipment Name", "IP Address", "Timestamp"] + (WINDOW_COLUMNS if window else []) + list(names)
+
+
+class CsvFile:
+    """An open daily CSV file of one output."""
+
+    def __init__(self, path, headers):
+        self.path = path
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:  # Write headers only if file is empty/new
+            self.writer.writerow(headers)
+
+    def close(self):
+        self.file.close()
+
+
+class QueuedSink:
+    """
+    Base for sinks written by a dedicated thread.
+    Pollers only queue captures; the writer thread drains the queue in batches and calls write_batch(),
+    and flush() every `flush_interval` seconds (0 flushes after every batch).
+    With a LatencyRecorder, the time each batch was written is recorded as its persisted stage.
+
+    With a `spool_dir`, captures are appended to a disk spool (see mtcp.spool) instead of the
+    in-memory queue, and the writer thread forwards them from there. Captures write_batch() puts in
+    `failed` stay in the spool and are retried with backoff, also after a restart; the spool only
+    moves past rows once flush() made them durable, so nothing is lost while the destination is away.
+
+    An unexpected error in write_batch() or flush() is logged and never ends the writer thread; see
+    write_guarded().
+    """
+
+    name = "sink"
+
+    def __init__(self, log=print, flush_interval=SINK_FLUSH_INTERVAL, latency=None, spool_dir=None):
+        self.log = log
+        self.flush_interval = flush_interval
+        self.latency = latency
+        self.failed = []  # Captures of the current batch whose write may succeed when retried
+        self.queue = queue.SimpleQueue()
+        METRICS.gauge("mtcp_sink_queue_depth", self.queue.qsize, sink=self.name)
+        if spool_dir:
+            self.spool = Spool(os.path.join(spool_dir, self.name), log)
+            self.closing = threading.Event()
+            METRICS.gauge("mtcp_sink_spool_bytes", self.spool.backlog_bytes, sink=self.name)
+            self.thread = threading.Thread(target=self.forward, daemon=True)
+        else:
+            self.spool = None
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, capture):
+        """Queue (or spool) one capture; never waits for the destination."""
+        if self.spool is not None:
+            self.spool.append(capture)
+        else:
+            self.queue.put(capture)
+
+    def close(self):
+        """Write every queued row, then release the sink's resources."""
+        if self.thread.is_alive():
+            if self.spool is not None:
+                self.closing.set()
+                self.spool.wake()
+            else:
+                self.queue.put(None)
+            self.thread.join()
+
+    def record_written(self, written, persisted_ns, timed=None):
+        """Count the rows written and record the latency of `timed` (default: all of them)."""
+        METRICS.inc("mtcp_sink_rows_written_total", len(written), sink=self.name)
+        if self.latency is not None:
+            self.latency.record_persisted(written if timed is None else timed, self.name, persisted_ns)
+
+    def write_guarded(self, batch):
+        """
+        Call write_batch(), surviving an unexpected error: the batch is then written again one capture
+        at a time, so only the captures that fail are dropped (rows before the error may be written twice).
+        Returns the captures that were written.
+        """
+        try:
+            return self.write_batch(batch)
+        except Exception as e:
+            self.log(f"Unexpected error in the {self.name} sink writing {len(batch)} capture(s) ({e!r}); "
+                     f"writing them one at a time.")
+        self.failed = []
+        written = []
+        for capture in batch:
+            try:
+                written.extend(self.write_batch([capture]))
+            except Exception as e:
+                METRICS.inc("mtcp_sink_errors_total", sink=self.name)
+                self.log(f"Dropped a capture of PLC '{capture.plc.get('line_name')}' in the {self.name} sink: {e!r}")
+        return written
+
+    def flush_guarded(self):
+        """Call flush(); an unexpected error is logged and counts as a failed flush."""
+        try:
+            return self.flush()
+        except Exception as e:
+            self.log(f"Unexpected error flushing the {self.name} sink: {e!r}")
+            return False
+
+    def run(self):
+        """Writer thread: drain the queue in batches until close() is called."""
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            batch = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval or None)
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= SINK_BATCH_SIZE:
+                        break
+                    item = self.queue.get_nowait()
+                running = item is not None
+            except queue.Empty:
+                pass
+
+            if batch:
+                self.failed = []
+                written = self.write_guarded(batch)
+                if written:
+                    self.record_written(written, time.monotonic_ns())
+            now = time.monotonic()
+            if not running or now - last_flush >= self.flush_interval:
+                self.flush_guarded()
+                last_flush = now
+
+        self.release()
+
+    def forward(self):
+        """Writer thread of a spooled sink: forward the spool to the destination until close() is called."""
+        backoff = Backoff()
+        position = self.spool.cursor
+        done = set()  # Positions of the records of the current batch already written
+        last_flush = time.monotonic()
+        while True:
+            records, after = self.spool.read(position, SINK_BATCH_SIZE)
+            if records:
+                self.failed = []
+                written = self.write_guarded([capture for record, capture in records if record not in done])
+                if written:
+                    # Latency is only meaningful for captures of this run: their timestamps are monotonic
+                    current = {id(capture) for record, capture in records if record[0] >= self.spool.run_start}
+                    self.record_written(written, time.monotonic_ns(),
+                                        [capture for capture in written if id(capture) in current])
+                if self.failed:
+                    failed = set(map(id, self.failed))
+                    done.update(record for record, capture in records if id(capture) not in failed)
+                    if self.closing.is_set():
+                        self.log(f"{len(self.failed)} capture(s) of the {self.name} sink stay in its spool "
+                                 f"until the next start.")
+                        break
+                    delay = backoff.next_delay()
+                    self.log(f"{len(self.failed)} capture(s) of the {self.name} sink kept in its spool; "
+                             f"retrying in {delay:.1f} s.")
+                    self.closing.wait(delay)
+                    continue
+                backoff.reset()
+                done.clear()
+            position = after
+
+            now = time.monotonic()
+            if now - last_flush >= self.flush_interval or (not records and self.closing.is_set()):
+                self.spool.sync()
+                if self.flush_guarded() is False:
+                    position = self.spool.cursor  # Write the rows since the last durable point again
+                else:
+                    self.spool.commit(position)
+                last_flush = now
+            if not records:
+                if self.closing.is_set():
+                    break
+                self.spool.wait(position, self.flush_interval or None)
+
+        self.spool.close()
+        self.release()
+
+    def write_batch(self, batch):
+        """Write a batch of captures; returns the captures that were written."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make the rows written so far durable; returns False if that failed."""
+
+    def release(self):
+        """Release files and connections once the writer thread ends."""
+
+
+class CsvSink(QueuedSink):
+    """
+    Write register data into one daily CSV file per output; rows of every PLC using the same output
+    go to the same file.
+    File handles stay open per (folder, file name, date), so pollers never block on disk.
+    With `fsync`, every flush also syncs the files to disk.
+    """
+
+    name = "csv"
+
+    def __init__(self, log=print, flush_interval=SINK_FLUSH_INTERVAL, fsync=False, latency=None, spool_dir=None):
+        self.fsync = fsync
+        self.files = {}  # (folder, file name) -> CsvFile of the current date
+        self.file_date = None
+        self.next_midnight = 0.0
+        self.last_second = None
+        self.last_timestamp = None
+        super().__init__(log, flush_interval, latency, spool_dir)
+
+    def release(self):
+        for csv_file in self.files.values():
+            csv_file.close()
+        self.files = {}
+
+    def roll_date(self, timestamp):
+        """Switch to a new file date when `timestamp` passes midnight; returns the current date string."""
+        if timestamp >= self.next_midnight:
+            day = time.localtime(timestamp)
+            self.file_date = time.strftime("%Y-%m-%d", day)
+            self.next_midnight = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+            for csv_file in self.files.values():
+                csv_file.close()
+            self.files = {}
+        return self.file_date
+
+    def format_timestamp(self, timestamp):
+        """Format `timestamp` for the Timestamp column, once per second."""
+        second = int(timestamp)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return self.last_timestamp
+
+    def open_file(self, output_folder, file_name, headers):
+        key = (output_folder, file_name)
+        csv_file = self.files.get(key)
+        if csv_file is None:
+            # Ensure the output folder exists
+            if not os.path.exists(output_folder):
+                os.makedirs(output_folder)
+            csv_file = CsvFile(os.path.join(output_folder, f"{file_name}_{self.file_date}.csv"), headers)
+            self.files[key] = csv_file
+        return csv_file
+
+    def write_batch(self, batch):
+        """Write a batch of queued rows, with one message per file."""
+        written = []
+        row_counts = {}
+        for capture in batch:
+            output, plc, register_data, category = capture.output, capture.plc, capture.registers, capture.category
+            output_folder = output.get("folder_path", "")
+            file_name = output.get("file_name", "")
+            if not output_folder or not file_name:
+                self.log(f"No valid folder path or file name configured for PLC '{plc['line_name']}' in category '{category}'.")
+                continue
+
+            self.roll_date(capture.capture_time)
+
+            # Data row for this PLC, stamped with the time the trigger was observed, followed by
+            # the decoded tags of the output or else the register values straight from the capture's array
+            row = [plc["line_name"], plc["equipment_name"], plc["ip_address"], self.format_timestamp(capture.capture_time)]
+            window = capture.window is not None
+            if window:
+                row.extend(capture.window)
+            if capture.tag_values is not None:
+                row.extend(capture.tag_values)
+                headers = csv_tag_headers(tuple(tag_names(output)), window)
+            else:
+                row.extend(register_data)
+                headers = csv_headers(len(register_data), window)
+
+            try:
+                csv_file = self.open_file(output_folder, file_name, headers)
+                csv_file.writer.writerow(row)
+                written.append(capture)
+                row_counts[(csv_file.path, plc["line_name"])] = row_counts.get((csv_file.path, plc["line_name"]), 0) + 1
+            except Exception as e:
+                self.log(f"Error writing to {file_name} in {output_folder} for PLC '{plc['line_name']}' in category '{category}': {e}")
+                self.drop_file(output_folder, file_name)
+                self.failed.append(capture)
+
+        for (path, line_name), count in row_counts.items():
+            self.log(f"Written {count} row(s) for PLC '{line_name}' to {path}.")
+        return written
+
+    def drop_file(self, output_folder, file_name):
+        """Close a file after a write error so it is reopened for the next row."""
+        csv_file = self.files.pop((output_folder, file_name), None)
+        if csv_file is not None:
+            try:
+                csv_file.close()
+            except OSError:
+                pass
+
+    def flush(self):
+        """Flush (and optionally fsync) every open file."""
+        flushed = True
+        for key, csv_file in list(self.files.items()):
+            try:
+                csv_file.file.flush()
+                if self.fsync:
+                    os.fsync(csv_file.file.fileno())
+            except OSError as e:
+                self.log(f"Error flushing {csv_file.path}: {e}")
+                self.drop_file(*key)
+                flushed = False
+        return flushed
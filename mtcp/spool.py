@@ -0,0 +1,207 @@
+"""
+Local disk spool of a sink: captures are appended to numbered segment files before the sink writes
+them to its destination, so a slow or offline destination (such as a network share) never blocks
+the pollers and loses nothing.
+
+A segment `{sequence:012d}.seg` holds records of a length, a CRC-32 and a pickled Capture.
+The file `cursor` holds the position up to which the destination has made the records durable;
+segments before it are deleted. A process that crashed mid-append leaves a torn record at the end
+of its last segment, which is skipped: every run appends to a new segment.
+"""
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# Spool folder of the GUI, next to its configuration files
+DEFAULT_SPOOL_DIR = "spool"
+
+# Size in bytes after which the spool continues in a new segment
+SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+# Record header: payload length and CRC-32 of the payload
+RECORD_HEADER = struct.Struct(">II")
+
+
+class Spool:
+    """
+    Append-only segment files in `directory`, written by the pollers and read by one forwarder.
+    Positions are (segment sequence, byte offset) pairs.
+    """
+
+    def __init__(self, directory, log=print, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.log = log
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        self.closed = False
+
+        sequences = self.sequences()
+        cursor = self.load_cursor()
+        if cursor is None or cursor[0] not in sequences:
+            # Continue at the oldest segment the cursor has not passed
+            later = [sequence for sequence in sequences if cursor is None or sequence > cursor[0]]
+            cursor = (later[0], 0) if later else None
+        self.run_start = sequences[-1] + 1 if sequences else 0  # First segment written by this process
+        self.cursor = cursor or (self.run_start, 0)
+        self.sequence = None
+        self.file = None
+        self.size = 0
+        self.unsynced = []  # Finished segments not synced yet
+        self.open_segment(self.run_start)
+        self.reader = None  # (sequence, file) of the segment being read
+
+    def path(self, sequence):
+        return os.path.join(self.directory, f"{sequence:012d}{SEGMENT_SUFFIX}")
+
+    def sequences(self):
+        """Sequence numbers of the segments on disk, in order."""
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as file:
+                sequence, offset = file.read().split()
+            return int(sequence), int(offset)
+        except (OSError, ValueError):
+            return None
+
+    def open_segment(self, sequence):
+        if self.file is not None:
+            self.file.close()
+        self.sequence = sequence
+        self.file = open(self.path(sequence), "ab")
+        self.size = self.file.tell()
+
+    def append(self, capture):
+        """
+        Append one capture; it is handed to the operating system before this returns.
+        Pollers call this, so it never waits for the disk: sync() makes the segments durable.
+        """
+        data = pickle.dumps(capture, pickle.HIGHEST_PROTOCOL)
+        record = RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self.lock:
+            if self.size >= self.segment_bytes:
+                self.unsynced.append(self.sequence)
+                self.open_segment(self.sequence + 1)
+            self.file.write(record)
+            self.file.flush()
+            self.size += len(record)
+            self.appended.notify_all()
+
+    def sync(self):
+        """
+        fsync the segments finished since the last sync and the one being written.
+        The lock is only held to take a duplicate of the file descriptor, so appends go on meanwhile.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            sequences, self.unsynced = self.unsynced, []
+            descriptor = os.dup(self.file.fileno())
+        try:
+            for sequence in sequences:
+                try:
+                    with open(self.path(sequence), "ab") as file:
+                        os.fsync(file.fileno())
+                except FileNotFoundError:
+                    pass
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def backlog_bytes(self):
+        """Bytes of the segments from the cursor on, less what the cursor has passed in its segment."""
+        total = 0
+        for sequence in self.sequences():
+            if sequence >= self.cursor[0]:
+                try:
+                    total += os.path.getsize(self.path(sequence))
+                except OSError:
+                    pass
+        return max(0, total - self.cursor[1])
+
+    def wait(self, position, timeout):
+        """Wait up to `timeout` seconds (None: forever) for records after `position`, or for wake()."""
+        with self.lock:
+            if position == (self.sequence, self.size) and not self.closed:
+                self.appended.wait(timeout)
+
+    def wake(self):
+        with self.lock:
+            self.appended.notify_all()
+
+    def segment_reader(self, sequence):
+        if self.reader is None or self.reader[0] != sequence:
+            if self.reader is not None:
+                self.reader[1].close()
+            self.reader = (sequence, open(self.path(sequence), "rb"))
+        return self.reader[1]
+
+    def read(self, position, limit):
+        """
+        Return up to `limit` records after `position` as (position, capture) pairs, and the position after them.
+        A record that is torn or corrupt ends its segment unless the segment is still being written.
+        """
+        records = []
+        sequence, offset = position
+        while len(records) < limit:
+            with self.lock:
+                writing, end = self.sequence, self.size
+            if sequence == writing and offset >= end:
+                break
+            try:
+                file = self.segment_reader(sequence)
+            except FileNotFoundError:
+                sequence, offset = sequence + 1, 0
+                continue
+            file.seek(offset)
+            header = file.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                length, checksum = RECORD_HEADER.unpack(header)
+                data = file.read(length)
+                if len(data) == length and zlib.crc32(data) == checksum:
+                    records.append(((sequence, offset), pickle.loads(data)))
+                    offset += RECORD_HEADER.size + length
+                    continue
+            if sequence == writing:
+                break  # The rest of the record is still being written
+            if header:
+                self.log(f"Skipped a damaged record at the end of spool segment {self.path(sequence)}.")
+            sequence, offset = sequence + 1, 0
+        return records, (sequence, offset)
+
+    def commit(self, position):
+        """Record that everything before `position` is durable at the destination; drop finished segments."""
+        if position == self.cursor:
+            return
+        cursor_path = os.path.join(self.directory, CURSOR_FILE)
+        with open(cursor_path + ".tmp", "w") as file:
+            file.write(f"{position[0]} {position[1]}")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(cursor_path + ".tmp", cursor_path)
+        self.cursor = position
+        for sequence in self.sequences():
+            if sequence >= position[0]:
+                break
+            if self.reader is not None and self.reader[0] == sequence:
+                self.reader[1].close()
+                self.reader = None
+            os.remove(self.path(sequence))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.file.close()
+            self.appended.notify_all()
+        if self.reader is not None:
+            self.reader[1].close()
+            self.reader = None
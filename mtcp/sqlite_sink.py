@@ -0,0 +1,189 @@
+"""
+SQLite sink: captured snapshots in one local database, indexed for traceability lookups.
+"""
+import json
+import sqlite3
+import sys
+from array import array
+
+from mtcp.sinks import SINK_FLUSH_INTERVAL, QueuedSink
+from mtcp.tags import tag_names
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    line_name TEXT NOT NULL,
+    equipment_name TEXT NOT NULL,
+    ip_address TEXT NOT NULL,
+    category TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    key_value TEXT,
+    registers BLOB NOT NULL,
+    tags TEXT,
+    sample INTEGER,
+    trigger INTEGER
+);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures (timestamp);
+CREATE INDEX IF NOT EXISTS captures_line ON captures (line_name, timestamp);
+CREATE INDEX IF NOT EXISTS captures_equipment ON captures (equipment_name, timestamp);
+CREATE INDEX IF NOT EXISTS captures_key ON captures (key_value);
+"""
+
+INSERT = """
+INSERT INTO captures (timestamp, line_name, equipment_name, ip_address, category, file_name, key_value, registers, tags, sample, trigger)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Columns added since the first schema, created in older databases when they are opened
+ADDED_COLUMNS = [("tags", "TEXT"), ("sample", "INTEGER"), ("trigger", "INTEGER")]
+
+
+def pack_registers(register_data):
+    """Pack register values as big-endian 16-bit words."""
+    words = array("H", register_data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+
+def unpack_registers(blob):
+    """Inverse of pack_registers."""
+    words = array("H", blob)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tolist()
+
+
+def key_value(output, register_data):
+    """
+    Return the lookup key of a snapshot, taken from the output's `key_register` (absolute address)
+    and `key_length` (number of registers, default 1).
+    A single register is stored as its number; several registers are an ASCII string such as a serial number.
+    """
+    key_register = output.get("key_register")
+    if key_register is None:
+        return None
+    offset = int(key_register) - int(output["start_register"])
+    length = int(output.get("key_length", 1))
+    words = register_data[offset:offset + length]
+    if offset < 0 or len(words) < length:
+        return None
+    if length == 1:
+        return str(words[0])
+    return pack_registers(words).decode("ascii", errors="replace").strip("\x00 ")
+
+
+def tags_json(capture):
+    """The decoded tags of a capture as a JSON object, or None."""
+    if capture.tag_values is None:
+        return None
+    return json.dumps(dict(zip(tag_names(capture.output), capture.tag_values)))
+
+
+class SqliteSink(QueuedSink):
+    """
+    Write captured snapshots into a local SQLite database in WAL mode.
+    Rows are inserted in one transaction per batch; timestamp, line, equipment and the key register are indexed.
+    The decoded tags of an output are stored next to its registers as a JSON object, and a sample
+    of a trigger window with its number relative to the edge sample and its trigger value.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, log=print, flush_interval=SINK_FLUSH_INTERVAL, latency=None, spool_dir=None):
+        self.path = path
+        self.connection = None
+        super().__init__(log, flush_interval, latency, spool_dir)
+
+    def connect(self):
+        if self.connection is None:
+            # Opened by the writer thread, which is the only one using it
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(captures)")]
+            for column, column_type in ADDED_COLUMNS:
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE captures ADD COLUMN {column} {column_type}")
+        return self.connection
+
+    def write_batch(self, batch):
+        rows = []
+        for capture in batch:
+            rows.append((
+                capture.capture_time,
+                capture.plc["line_name"],
+                capture.plc["equipment_name"],
+                capture.plc["ip_address"],
+                capture.category,
+                capture.output.get("file_name", ""),
+                key_value(capture.output, capture.registers),
+                pack_registers(capture.registers),
+                tags_json(capture),
+                capture.window[0] if capture.window is not None else None,
+                capture.window[1] if capture.window is not None else None,
+            ))
+
+        try:
+            connection = self.connect()
+            with connection:  # One transaction per batch
+                connection.executemany(INSERT, rows)
+            self.log(f"Written {len(rows)} row(s) to {self.path}.")
+            return batch
+        except sqlite3.Error as e:
+            self.log(f"Error writing {len(rows)} row(s) to {self.path}: {e}")
+            self.failed.extend(batch)
+            return []
+
+    def release(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def find_captures(path, key=None, line_name=None, equipment_name=None, start=None, end=None):
+    """
+    Look up captured snapshots in a database written by SqliteSink.
+    Every given criterion must match; `start` and `end` are epoch timestamps.
+    Returns a list of dictionaries with the decoded register values and tags.
+    """
+    conditions = []
+    parameters = []
+    for column, value in [("key_value", key), ("line_name", line_name), ("equipment_name", equipment_name)]:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(str(value))
+    if start is not None:
+        conditions.append("timestamp >= ?")
+        parameters.append(start)
+    if end is not None:
+        conditions.append("timestamp < ?")
+        parameters.append(end)
+
+    query = "SELECT timestamp, line_name, equipment_name, ip_address, category, file_name, key_value, registers, tags, sample, trigger FROM captures"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp"
+
+    connection = sqlite3.connect(path)
+    try:
+        captures = []
+        for row in connection.execute(query, parameters):
+            captures.append({
+                "timestamp": row[0],
+                "line_name": row[1],
+                "equipment_name": row[2],
+                "ip_address": row[3],
+                "category": row[4],
+                "file_name": row[5],
+                "key_value": row[6],
+                "registers": unpack_registers(row[7]),
+                "tags": json.loads(row[8]) if row[8] is not None else None,
+                "sample": row[9],
+                "trigger": row[10],
+            })
+        return captures
+    finally:
+        connection.close()
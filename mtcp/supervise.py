@@ -0,0 +1,80 @@
+"""
+Reconnect policy of the PLC pollers: jittered exponential backoff and a per-PLC circuit breaker.
+"""
+import random
+
+# Delay before the first reconnect attempt, doubled after every failure up to RECONNECT_MAX_DELAY
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+# Consecutive failures after which the circuit opens, and the seconds it stays open
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_TIME = 60.0
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th delay is uniform in [0, min(max_delay, base_delay * 2^n)],
+    so pollers that lost their PLCs at the same moment do not retry in lockstep.
+    """
+
+    def __init__(self, base_delay=RECONNECT_BASE_DELAY, max_delay=RECONNECT_MAX_DELAY):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.max_delay, self.base_delay * 2 ** self.attempts)
+        self.attempts += 1
+        return random.uniform(0, delay)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    """
+    Connection health of one PLC.
+    Closed: failures are retried after a backoff delay. After `failure_threshold` consecutive failures
+    the circuit opens and the PLC is left alone for about `open_time` seconds; the next attempt is a
+    single probe (half-open) that closes the circuit on success or opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, open_time=BREAKER_OPEN_TIME, backoff=None):
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time
+        self.backoff = backoff or Backoff()
+        self.state = self.CLOSED
+        self.failures = 0
+
+    @property
+    def is_open(self):
+        return self.state != self.CLOSED
+
+    def record_success(self):
+        """The PLC answered; returns True if it had failed before."""
+        recovered = self.failures > 0
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff.reset()
+        return recovered
+
+    def record_failure(self):
+        """
+        Count a failed connection or poll cycle.
+        Returns the seconds to wait before the next attempt; the state tells whether the circuit opened.
+        """
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            return self.open_time * random.uniform(0.8, 1.2)
+        return self.backoff.next_delay()
+
+    def probe(self):
+        """Called when an open circuit's wait is over: the next attempt is a half-open probe."""
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
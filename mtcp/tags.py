@@ -0,0 +1,141 @@
+"""
+Typed tags: named values decoded from an output's register block.
+
+An output lists its tags as
+
+    "tags": [
+        {"name": "serial", "offset": 0, "type": "STRING", "length": 10},
+        {"name": "temperature", "offset": 10, "type": "FLOAT32", "word_order": "little"},
+        {"name": "count", "offset": 12, "type": "UINT32", "scale": 0.1},
+        {"name": "running", "offset": 14, "type": "BOOL", "bit": 3}
+    ]
+
+`offset` is in registers from the output's start register. Every register is a big-endian word on
+the wire; `byte_order` swaps the bytes within each word and `word_order` the order of the words of a
+multi-register value (both "big" by default). `scale` multiplies numeric values, `length` is the
+number of registers of a STRING and `bit` the bit (0 = least significant) of a BOOL.
+The tags of an output are compiled once into a TagDecoder that decodes a whole block with one gather
+and one struct unpack.
+"""
+import struct
+import sys
+from array import array
+from operator import itemgetter
+
+# struct format and size in registers of every tag type; STRING takes its size from `length`
+TAG_TYPES = {
+    "INT16": ("h", 1),
+    "UINT16": ("H", 1),
+    "INT32": ("i", 2),
+    "UINT32": ("I", 2),
+    "INT64": ("q", 4),
+    "UINT64": ("Q", 4),
+    "FLOAT32": ("f", 2),
+    "FLOAT64": ("d", 4),
+    "STRING": ("s", None),
+    "BOOL": ("H", 1),
+}
+
+
+def tag_size(tag):
+    """Number of registers a tag spans."""
+    tag_type = tag.get("type", "UINT16")
+    if tag_type == "STRING":
+        return int(tag["length"])
+    return TAG_TYPES[tag_type][1]
+
+
+def tag_byte_indices(tag):
+    """Indices of the tag's bytes in the block's wire bytes, in big-endian order."""
+    offset = int(tag.get("offset", 0))
+    words = list(range(offset, offset + tag_size(tag)))
+    if tag.get("word_order", "big") == "little":
+        words.reverse()
+    indices = []
+    for word in words:
+        if tag.get("byte_order", "big") == "little":
+            indices.extend((2 * word + 1, 2 * word))
+        else:
+            indices.extend((2 * word, 2 * word + 1))
+    return indices
+
+
+def tag_converter(tag):
+    """Return the function applied to a tag's unpacked value, or None."""
+    tag_type = tag.get("type", "UINT16")
+    if tag_type == "STRING":
+        return lambda value: value.decode("ascii", errors="replace").strip("\x00 ")
+    if tag_type == "BOOL":
+        bit = int(tag.get("bit", 0))
+        return lambda value: bool((value >> bit) & 1)
+    scale = tag.get("scale")
+    if scale is not None and float(scale) != 1.0:
+        scale = float(scale)
+        return lambda value: value * scale
+    return None
+
+
+class TagDecoder:
+    """
+    Decoder of the typed tags of one output, compiled once.
+    decode() turns the register array of a capture into a tuple of values in tag order.
+    """
+
+    def __init__(self, tags, register_range):
+        self.names = []
+        formats = []
+        indices = []
+        self.converters = []
+        for tag in tags:
+            name = tag.get("name")
+            tag_type = tag.get("type", "UINT16")
+            if not name:
+                raise ValueError("Every tag needs a name.")
+            if tag_type not in TAG_TYPES:
+                raise ValueError(f"Unsupported type '{tag_type}' of tag '{name}'.")
+            offset = int(tag.get("offset", 0))
+            if offset < 0 or offset + tag_size(tag) > register_range:
+                raise ValueError(f"Tag '{name}' lies outside the register range.")
+            code = TAG_TYPES[tag_type][0]
+            formats.append(f"{2 * tag_size(tag)}s" if code == "s" else code)
+            indices.extend(tag_byte_indices(tag))
+            self.names.append(name)
+            self.converters.append(tag_converter(tag))
+
+        self.struct = struct.Struct(">" + "".join(formats))
+        # Gathering the tag bytes is skipped when they already lie in order at the start of the block
+        self.gather = None if indices == list(range(len(indices))) else itemgetter(*indices)
+        self.size = len(indices)
+        self.has_converters = any(self.converters)
+
+    def wire_bytes(self, registers):
+        """The block as transmitted: big-endian 16-bit words."""
+        words = array("H", registers)
+        if sys.byteorder == "little":
+            words.byteswap()
+        return words.tobytes()
+
+    def decode(self, registers):
+        data = self.wire_bytes(registers)
+        if self.gather is None:
+            data = data[:self.size]
+        else:
+            data = bytes(self.gather(data))
+        values = self.struct.unpack(data)
+        if not self.has_converters:
+            return values
+        return tuple(value if converter is None else converter(value)
+                     for value, converter in zip(values, self.converters))
+
+
+def compile_tags(output):
+    """Return the TagDecoder of an output with `tags`, or None."""
+    tags = output.get("tags")
+    if not tags:
+        return None
+    return TagDecoder(tags, int(output["range"]))
+
+
+def tag_names(output):
+    """Column names of the decoded tags of an output."""
+    return [tag["name"] for tag in output.get("tags", [])]
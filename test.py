@@ -1,19 +1,23 @@
 import tkinter as tk
-from datetime import datetime
-import threading
 from tkinter import ttk, messagebox, filedialog
 from pymodbus.client import ModbusTcpClient
-import json
 import os
-import csv
 import re
-import time
 
-# File paths for storing configurations
-PLC_CONFIG_FILE = "plc_configs.json"
-TRACEABILITY_CONFIG_FILE = "traceability_configs.json"
-ERROR_CODE_CONFIG_FILE = "error_code_configs.json"
-DOWN_TIME_CONFIG_FILE = "down_time_configs.json"
+from mtcp.config import (PLC_CONFIG_FILE, TRACEABILITY_CONFIG_FILE, ERROR_CODE_CONFIG_FILE,
+                         DOWN_TIME_CONFIG_FILE, load_config_file, save_config_file, monitored_outputs,
+                         parse_names, format_names)
+from mtcp.engine import ThreadedEngine
+from mtcp.modbus import DEFAULT_UNIT_ID
+from mtcp.schedule import POLL_INTERVAL_MS
+from mtcp.async_engine import AsyncEngine
+from mtcp.sinks import CsvSink
+from mtcp.spool import DEFAULT_SPOOL_DIR
+from mtcp.latency import LatencyRecorder
+from mtcp.logpipe import LogPipeline
+
+# Milliseconds between refreshes of the monitoring log text box
+LOG_REFRESH_MS = 250
 
 
 class PLCManagerApp:
@@ -66,6 +70,9 @@ class PLCManagerApp:
         self.down_time_configs = []
 
         self.monitoring = False
+        self.engine = None
+        self.sink = None
+        self.latency = LatencyRecorder()
         self.selected_plc_index = None
         self.selected_traceability_index = None
         self.selected_error_code_index = None
@@ -86,10 +93,24 @@ class PLCManagerApp:
         self.stop_button = tk.Button(self.root, text="Stop", command=self.stop_monitoring, bg="white", fg="black")
         self.stop_button.pack(side="left", padx=10, pady=10)
 
+        # Monitoring engine selection
+        ttk.Label(self.root, text="Engine:").pack(side="left", padx=5, pady=10)
+        self.engine_combobox = ttk.Combobox(self.root, values=["Threaded", "Asyncio"], state="readonly", width=10)
+        self.engine_combobox.set("Threaded")
+        self.engine_combobox.pack(side="left", padx=5, pady=10)
+
+        # Trigger-to-capture latency histograms
+        self.latency_button = tk.Button(self.root, text="Latency", command=self.show_latency, bg="white", fg="black")
+        self.latency_button.pack(side="left", padx=10, pady=10)
+
         # Textbox output for monitoring logs
         self.output_text = tk.Text(self.root, height=5, width=80)
         self.output_text.pack(side="bottom", padx=5, pady=5)
 
+        # Engine messages are queued here and shown by refresh_output_text on the Tk main loop
+        self.log_pipeline = LogPipeline()
+        self.root.after(LOG_REFRESH_MS, self.refresh_output_text)
+
         # Save data and clean up on close
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
@@ -137,15 +158,26 @@ class PLCManagerApp:
         self.port_entry = ttk.Entry(self.plc_tab)
         self.port_entry.grid(row=3, column=1, padx=5, pady=5)
 
+        # Comma-separated groups, used to assign outputs to this PLC
+        ttk.Label(self.plc_tab, text="Groups:").grid(row=4, column=0, padx=5, pady=5)
+        self.groups_entry = ttk.Entry(self.plc_tab)
+        self.groups_entry.grid(row=4, column=1, padx=5, pady=5)
+
+        # Modbus unit ID, for PLCs sharing a Modbus TCP/RTU gateway
+        ttk.Label(self.plc_tab, text="Unit ID:").grid(row=5, column=0, padx=5, pady=5)
+        self.unit_id_entry = ttk.Entry(self.plc_tab)
+        self.unit_id_entry.grid(row=5, column=1, padx=5, pady=5)
+        self.unit_id_entry.insert(0, str(DEFAULT_UNIT_ID))
+
         # Buttons for Add, Edit, Save, and Delete
-        ttk.Button(self.plc_tab, text="Add PLC", command=self.add_plc_config).grid(row=4, column=0, padx=5, pady=5)
-        ttk.Button(self.plc_tab, text="Edit PLC", command=self.edit_plc_config).grid(row=4, column=1, padx=5, pady=5)
-        ttk.Button(self.plc_tab, text="Save PLC", command=self.save_plc_config).grid(row=4, column=2, padx=5, pady=5)
-        ttk.Button(self.plc_tab, text="Delete PLC", command=self.delete_plc_config).grid(row=4, column=3, padx=5, pady=5)
+        ttk.Button(self.plc_tab, text="Add PLC", command=self.add_plc_config).grid(row=6, column=0, padx=5, pady=5)
+        ttk.Button(self.plc_tab, text="Edit PLC", command=self.edit_plc_config).grid(row=6, column=1, padx=5, pady=5)
+        ttk.Button(self.plc_tab, text="Save PLC", command=self.save_plc_config).grid(row=6, column=2, padx=5, pady=5)
+        ttk.Button(self.plc_tab, text="Delete PLC", command=self.delete_plc_config).grid(row=6, column=3, padx=5, pady=5)
 
         # Listbox to display PLC configurations
-        self.plc_list = tk.Listbox(self.plc_tab, height=23, width=100)
-        self.plc_list.grid(row=5, column=0, columnspan=4, padx=10, pady=10)
+        self.plc_list = tk.Listbox(self.plc_tab, height=19, width=100)
+        self.plc_list.grid(row=7, column=0, columnspan=4, padx=10, pady=10)
 
     def initialize_traceability_tab(self):
         """Initialize TRACEABILITY Tab."""
@@ -183,15 +215,24 @@ class PLCManagerApp:
         # Browse Button
         ttk.Button(self.traceability_tab, text="Browse", command=lambda: self.browse_folder_path(self.traceability_folder_path_entry)).grid(row=6, column=2, padx=5, pady=5)
 
+        ttk.Label(self.traceability_tab, text="Poll Interval (ms):").grid(row=7, column=0, padx=5, pady=5)
+        self.poll_interval_entry1 = ttk.Entry(self.traceability_tab)
+        self.poll_interval_entry1.grid(row=7, column=1, padx=5, pady=5)
+
+        # Comma-separated PLC groups polling this output; empty means every PLC
+        ttk.Label(self.traceability_tab, text="PLC Groups:").grid(row=8, column=0, padx=5, pady=5)
+        self.groups_entry1 = ttk.Entry(self.traceability_tab)
+        self.groups_entry1.grid(row=8, column=1, padx=5, pady=5)
+
         # Buttons for Add, Edit, Save, and Delete
-        ttk.Button(self.traceability_tab, text="Add Output", command=self.add_traceability_config).grid(row=7, column=0, padx=5, pady=5)
-        ttk.Button(self.traceability_tab, text="Edit Output", command=self.edit_traceability_config).grid(row=7, column=1, padx=5, pady=5)
-        ttk.Button(self.traceability_tab, text="Save Output", command=self.save_traceability_config).grid(row=7, column=2, padx=5, pady=5)
-        ttk.Button(self.traceability_tab, text="Delete Output", command=self.delete_traceability_config).grid(row=7, column=3, padx=5, pady=5)
+        ttk.Button(self.traceability_tab, text="Add Output", command=self.add_traceability_config).grid(row=9, column=0, padx=5, pady=5)
+        ttk.Button(self.traceability_tab, text="Edit Output", command=self.edit_traceability_config).grid(row=9, column=1, padx=5, pady=5)
+        ttk.Button(self.traceability_tab, text="Save Output", command=self.save_traceability_config).grid(row=9, column=2, padx=5, pady=5)
+        ttk.Button(self.traceability_tab, text="Delete Output", command=self.delete_traceability_config).grid(row=9, column=3, padx=5, pady=5)
 
         # Listbox to display TRACEABILITY
-        self.traceability_list = tk.Listbox(self.traceability_tab, height=16, width=100)
-        self.traceability_list.grid(row=8, column=0, columnspan=4, padx=10, pady=10)
+        self.traceability_list = tk.Listbox(self.traceability_tab, height=12, width=100)
+        self.traceability_list.grid(row=10, column=0, columnspan=4, padx=10, pady=10)
 
     def initialize_error_code_tab(self):
         """Initialize ERROR_CODE Tab."""
@@ -229,15 +270,24 @@ class PLCManagerApp:
         # Browse Button
         ttk.Button(self.error_code_tab, text="Browse", command=lambda: self.browse_folder_path(self.error_code_folder_path_entry)).grid(row=6, column=2, padx=5, pady=5)
 
+        ttk.Label(self.error_code_tab, text="Poll Interval (ms):").grid(row=7, column=0, padx=5, pady=5)
+        self.poll_interval_entry2 = ttk.Entry(self.error_code_tab)
+        self.poll_interval_entry2.grid(row=7, column=1, padx=5, pady=5)
+
+        # Comma-separated PLC groups polling this output; empty means every PLC
+        ttk.Label(self.error_code_tab, text="PLC Groups:").grid(row=8, column=0, padx=5, pady=5)
+        self.groups_entry2 = ttk.Entry(self.error_code_tab)
+        self.groups_entry2.grid(row=8, column=1, padx=5, pady=5)
+
         # Buttons for Add, Edit, Save, and Delete
-        ttk.Button(self.error_code_tab, text="Add Output", command=self.add_error_code_config).grid(row=7, column=0, padx=5, pady=5)
-        ttk.Button(self.error_code_tab, text="Edit Output", command=self.edit_error_code_config).grid(row=7, column=1, padx=5, pady=5)
-        ttk.Button(self.error_code_tab, text="Save Output", command=self.save_error_code_config).grid(row=7, column=2, padx=5, pady=5)
-        ttk.Button(self.error_code_tab, text="Delete Output", command=self.delete_error_code_config).grid(row=7, column=3, padx=5, pady=5)
+        ttk.Button(self.error_code_tab, text="Add Output", command=self.add_error_code_config).grid(row=9, column=0, padx=5, pady=5)
+        ttk.Button(self.error_code_tab, text="Edit Output", command=self.edit_error_code_config).grid(row=9, column=1, padx=5, pady=5)
+        ttk.Button(self.error_code_tab, text="Save Output", command=self.save_error_code_config).grid(row=9, column=2, padx=5, pady=5)
+        ttk.Button(self.error_code_tab, text="Delete Output", command=self.delete_error_code_config).grid(row=9, column=3, padx=5, pady=5)
 
         # Listbox to display TRACEABILITY
-        self.error_code_list = tk.Listbox(self.error_code_tab, height=16, width=100)
-        self.error_code_list.grid(row=8, column=0, columnspan=4, padx=10, pady=10)
+        self.error_code_list = tk.Listbox(self.error_code_tab, height=12, width=100)
+        self.error_code_list.grid(row=10, column=0, columnspan=4, padx=10, pady=10)
 
     def initialize_down_time_tab(self):
         """Initialize DOWN_TIME Tab."""
@@ -275,72 +325,67 @@ class PLCManagerApp:
         # Browse Button
         ttk.Button(self.down_time_tab, text="Browse", command=lambda: self.browse_folder_path(self.down_time_folder_path_entry)).grid(row=6, column=2, padx=5, pady=5)
 
+        ttk.Label(self.down_time_tab, text="Poll Interval (ms):").grid(row=7, column=0, padx=5, pady=5)
+        self.poll_interval_entry3 = ttk.Entry(self.down_time_tab)
+        self.poll_interval_entry3.grid(row=7, column=1, padx=5, pady=5)
+
+        # Comma-separated PLC groups polling this output; empty means every PLC
+        ttk.Label(self.down_time_tab, text="PLC Groups:").grid(row=8, column=0, padx=5, pady=5)
+        self.groups_entry3 = ttk.Entry(self.down_time_tab)
+        self.groups_entry3.grid(row=8, column=1, padx=5, pady=5)
+
         # Buttons for Add, Edit, Save, and Delete
-        ttk.Button(self.down_time_tab, text="Add Output", command=self.add_down_time_config).grid(row=7, column=0, padx=5, pady=5)
-        ttk.Button(self.down_time_tab, text="Edit Output", command=self.edit_down_time_config).grid(row=7, column=1, padx=5, pady=5)
-        ttk.Button(self.down_time_tab, text="Save Output", command=self.save_down_time_config).grid(row=7, column=2, padx=5, pady=5)
-        ttk.Button(self.down_time_tab, text="Delete Output", command=self.delete_down_time_config).grid(row=7, column=3, padx=5, pady=5)
+        ttk.Button(self.down_time_tab, text="Add Output", command=self.add_down_time_config).grid(row=9, column=0, padx=5, pady=5)
+        ttk.Button(self.down_time_tab, text="Edit Output", command=self.edit_down_time_config).grid(row=9, column=1, padx=5, pady=5)
+        ttk.Button(self.down_time_tab, text="Save Output", command=self.save_down_time_config).grid(row=9, column=2, padx=5, pady=5)
+        ttk.Button(self.down_time_tab, text="Delete Output", command=self.delete_down_time_config).grid(row=9, column=3, padx=5, pady=5)
 
         # Listbox to display TRACEABILITY
-        self.down_time_list = tk.Listbox(self.down_time_tab, height=16, width=100)
-        self.down_time_list.grid(row=8, column=0, columnspan=4, padx=10, pady=10)
+        self.down_time_list = tk.Listbox(self.down_time_tab, height=12, width=100)
+        self.down_time_list.grid(row=10, column=0, columnspan=4, padx=10, pady=10)
 
     def load_plc_configs(self):
         """Load PLC configurations from JSON file."""
-        if os.path.exists(PLC_CONFIG_FILE):
-            with open(PLC_CONFIG_FILE, "r") as file:
-                self.plc_configs = json.load(file)
-            self.refresh_plc_list()
-        else:
-            self.plc_configs = []
+        self.plc_configs = load_config_file(PLC_CONFIG_FILE)
+        self.refresh_plc_list()
 
     def load_traceability_configs(self):
         """Load TRACEABILITY configurations from JSON file."""
-        if os.path.exists(TRACEABILITY_CONFIG_FILE):
-            with open(TRACEABILITY_CONFIG_FILE, "r") as file:
-                self.traceability_configs = json.load(file)
-            self.refresh_traceability_list()
-        else:
-            self.traceability_configs = []
+        self.traceability_configs = load_config_file(TRACEABILITY_CONFIG_FILE)
+        self.refresh_traceability_list()
 
     def load_error_code_configs(self):
         """Load ERROR_CODE configurations from JSON file."""
-        if os.path.exists(ERROR_CODE_CONFIG_FILE):
-            with open(ERROR_CODE_CONFIG_FILE, "r") as file:
-                self.error_code_configs = json.load(file)
-            self.refresh_error_code_list()
-        else:
-            self.error_code_configs = []
+        self.error_code_configs = load_config_file(ERROR_CODE_CONFIG_FILE)
+        self.refresh_error_code_list()
 
     def load_down_time_configs(self):
         """Load DOWN_TIME configurations from JSON file."""
-        if os.path.exists(DOWN_TIME_CONFIG_FILE):
-            with open(DOWN_TIME_CONFIG_FILE, "r") as file:
-                self.down_time_configs = json.load(file)
-            self.refresh_down_time_list()
-        else:
-            self.down_time_configs = []
+        self.down_time_configs = load_config_file(DOWN_TIME_CONFIG_FILE)
+        self.refresh_down_time_list()
 
     def save_all_configs(self):
         """Save all configurations to JSON files."""
-        with open(PLC_CONFIG_FILE, "w") as file:
-            json.dump(self.plc_configs, file, indent=4)
-
-        with open(TRACEABILITY_CONFIG_FILE, "w") as file:
-            json.dump(self.traceability_configs, file, indent=4)
-
-        with open(ERROR_CODE_CONFIG_FILE, "w") as file:
-            json.dump(self.error_code_configs, file, indent=4)
-
-        with open(DOWN_TIME_CONFIG_FILE, "w") as file:
-            json.dump(self.down_time_configs, file, indent=4)
+        save_config_file(PLC_CONFIG_FILE, self.plc_configs)
+        save_config_file(TRACEABILITY_CONFIG_FILE, self.traceability_configs)
+        save_config_file(ERROR_CODE_CONFIG_FILE, self.error_code_configs)
+        save_config_file(DOWN_TIME_CONFIG_FILE, self.down_time_configs)
+        self.reload_monitoring()
+
+    def reload_monitoring(self):
+        """Apply the saved configurations to a running engine; only the affected PLC pollers restart."""
+        if self.engine is not None and self.engine.is_running():
+            outputs = monitored_outputs(self.traceability_configs, self.error_code_configs, self.down_time_configs)
+            self.engine.reload(self.plc_configs, outputs)
 
     def refresh_plc_list(self):
         """Refresh the Listbox with updated PLC configurations."""
         self.plc_list.delete(0, tk.END)
         for i, plc in enumerate(self.plc_configs):
             status = plc.get("status", "Not Connected")
-            self.plc_list.insert(tk.END, f"{i + 1}. {plc['line_name']} ({plc['ip_address']}:{plc['port']}) - {status}")
+            groups = f" Groups:{format_names(plc['groups'])}" if plc.get("groups") else ""
+            unit = f" Unit:{plc['unit_id']}" if "unit_id" in plc else ""
+            self.plc_list.insert(tk.END, f"{i + 1}. {plc['line_name']} ({plc['ip_address']}:{plc['port']}){unit} - {status}{groups}")
 
     def refresh_traceability_list(self):
         """Refresh the Listbox with updated TRACEABILITY configurations."""
@@ -393,11 +438,22 @@ class PLCManagerApp:
             messagebox.showerror("Error", "Port must be a valid integer between 1 and 65535.")
             return
 
+        # Validate unit ID range
+        try:
+            unit_id = int(self.unit_id_entry.get() or DEFAULT_UNIT_ID)
+            if not 0 <= unit_id <= 247:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Unit ID must be a valid integer between 0 and 247.")
+            return
+
         plc_config = {
             "line_name": line_name,
             "equipment_name": equipment_name,
             "ip_address": ip_address,
             "port": port,
+            "unit_id": unit_id,
+            "groups": parse_names(self.groups_entry.get()),
             "status": "Not Connected"
         }
 
@@ -425,6 +481,7 @@ class PLCManagerApp:
         trigger_register_type = self.trigger_type_combobox1.get()
         trigger_register = self.trigger_entry1.get()
         folder_path = self.traceability_folder_path_entry.get()
+        poll_interval_ms = self.poll_interval_entry1.get() or POLL_INTERVAL_MS
 
         # Validate that start_register and reg_range are integers
         try:
@@ -441,6 +498,15 @@ class PLCManagerApp:
             messagebox.showerror("Error", "Trigger register must be a valid integer.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(poll_interval_ms)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
         # Validate folder_path is a valid path (optional, can add more checks)
         if not os.path.isdir(folder_path):
             messagebox.showerror("Error", f"Invalid folder path: {folder_path}")
@@ -455,6 +521,8 @@ class PLCManagerApp:
             "trigger_register_type": trigger_register_type,
             "trigger_register": trigger_register,
             "folder_path": folder_path,
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry1.get()),
         }
 
         # Append to traceability_configs list and refresh UI
@@ -474,6 +542,7 @@ class PLCManagerApp:
         trigger_register_type = self.trigger_type_combobox2.get()
         trigger_register = self.trigger_entry2.get()
         folder_path = self.error_code_folder_path_entry.get()
+        poll_interval_ms = self.poll_interval_entry2.get() or POLL_INTERVAL_MS
 
         # Validate that start_register and reg_range are integers
         try:
@@ -490,6 +559,15 @@ class PLCManagerApp:
             messagebox.showerror("Error", "Trigger register must be a valid integer.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(poll_interval_ms)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
         # Validate folder_path is a valid path (optional, can add more checks)
         if not os.path.isdir(folder_path):
             messagebox.showerror("Error", f"Invalid folder path: {folder_path}")
@@ -504,6 +582,8 @@ class PLCManagerApp:
             "trigger_register_type": trigger_register_type,
             "trigger_register": trigger_register,
             "folder_path": folder_path,
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry2.get()),
         }
 
         # Append to error_code_configs list and refresh UI
@@ -523,6 +603,7 @@ class PLCManagerApp:
         trigger_register_type = self.trigger_type_combobox3.get()
         trigger_register = self.trigger_entry3.get()
         folder_path = self.down_time_folder_path_entry.get()
+        poll_interval_ms = self.poll_interval_entry3.get() or POLL_INTERVAL_MS
 
         # Validate that start_register and reg_range are integers
         try:
@@ -539,6 +620,15 @@ class PLCManagerApp:
             messagebox.showerror("Error", "Trigger register must be a valid integer.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(poll_interval_ms)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
         # Validate folder_path is a valid path (optional, can add more checks)
         if not os.path.isdir(folder_path):
             messagebox.showerror("Error", f"Invalid folder path: {folder_path}")
@@ -553,6 +643,8 @@ class PLCManagerApp:
             "trigger_register_type": trigger_register_type,
             "trigger_register": trigger_register,
             "folder_path": folder_path,
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry3.get()),
         }
 
         # Append to traceability_configs list and refresh UI
@@ -581,6 +673,10 @@ class PLCManagerApp:
         self.ip_entry.insert(0, plc_config["ip_address"])
         self.port_entry.delete(0, tk.END)
         self.port_entry.insert(0, plc_config["port"])
+        self.groups_entry.delete(0, tk.END)
+        self.groups_entry.insert(0, format_names(plc_config.get("groups")))
+        self.unit_id_entry.delete(0, tk.END)
+        self.unit_id_entry.insert(0, str(plc_config.get("unit_id", DEFAULT_UNIT_ID)))
 
     def edit_traceability_config(self):
         """Edit an existing TRACEABILITY configuration."""
@@ -604,6 +700,10 @@ class PLCManagerApp:
         self.trigger_entry1.insert(0, traceability_config["trigger_register"])
         self.traceability_folder_path_entry.delete(0, tk.END)
         self.traceability_folder_path_entry.insert(0, traceability_config["folder_path"])
+        self.poll_interval_entry1.delete(0, tk.END)
+        self.poll_interval_entry1.insert(0, traceability_config.get("poll_interval_ms", POLL_INTERVAL_MS))
+        self.groups_entry1.delete(0, tk.END)
+        self.groups_entry1.insert(0, format_names(traceability_config.get("groups")))
 
     def edit_error_code_config(self):
         """Edit an existing ERROR_CODE configuration."""
@@ -627,6 +727,10 @@ class PLCManagerApp:
         self.trigger_entry2.insert(0, error_code_config["trigger_register"])
         self.error_code_folder_path_entry.delete(0, tk.END)
         self.error_code_folder_path_entry.insert(0, error_code_config["folder_path"])
+        self.poll_interval_entry2.delete(0, tk.END)
+        self.poll_interval_entry2.insert(0, error_code_config.get("poll_interval_ms", POLL_INTERVAL_MS))
+        self.groups_entry2.delete(0, tk.END)
+        self.groups_entry2.insert(0, format_names(error_code_config.get("groups")))
 
     def edit_down_time_config(self):
         """Edit an existing DOWN_TIME configuration."""
@@ -650,6 +754,10 @@ class PLCManagerApp:
         self.trigger_entry3.insert(0, down_time_config["trigger_register"])
         self.down_time_folder_path_entry.delete(0, tk.END)
         self.down_time_folder_path_entry.insert(0, down_time_config["folder_path"])
+        self.poll_interval_entry3.delete(0, tk.END)
+        self.poll_interval_entry3.insert(0, down_time_config.get("poll_interval_ms", POLL_INTERVAL_MS))
+        self.groups_entry3.delete(0, tk.END)
+        self.groups_entry3.insert(0, format_names(down_time_config.get("groups")))
 
     def save_plc_config(self):
         """Save changes made to an existing PLC configuration."""
@@ -657,11 +765,24 @@ class PLCManagerApp:
             messagebox.showwarning("Warning", "No configuration selected for saving.")
             return
 
+        # Validate unit ID range
+        try:
+            unit_id = int(self.unit_id_entry.get() or DEFAULT_UNIT_ID)
+            if not 0 <= unit_id <= 247:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Unit ID must be a valid integer between 0 and 247.")
+            return
+
+        # Keep settings that are only edited in the JSON file
         self.plc_configs[self.selected_plc_index] = {
+            **self.plc_configs[self.selected_plc_index],
             "line_name": self.line_entry.get(),
             "equipment_name": self.equipment_entry.get(),
             "ip_address": self.ip_entry.get(),
             "port": self.port_entry.get(),
+            "unit_id": unit_id,
+            "groups": parse_names(self.groups_entry.get()),
             "status": self.plc_configs[self.selected_plc_index].get("status", "Not Connected")
         }
 
@@ -676,14 +797,27 @@ class PLCManagerApp:
             messagebox.showwarning("Warning", "No configuration selected for saving.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(self.poll_interval_entry1.get() or POLL_INTERVAL_MS)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
+        # Keep settings that are only edited in the JSON file
         self.traceability_configs[self.selected_traceability_index] = {
+            **self.traceability_configs[self.selected_traceability_index],
             "file_name": self.file_name_entry1.get(),
             "register_type": self.reg_type_combobox1.get(),
             "start_register": int(self.start_reg_entry1.get()),
             "range": int(self.range_entry1.get()),
             "trigger_register_type": self.trigger_type_combobox1.get(),
             "trigger_register": int(self.trigger_entry1.get()),
-            "folder_path": self.traceability_folder_path_entry.get()
+            "folder_path": self.traceability_folder_path_entry.get(),
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry1.get())
         }
 
         self.selected_traceability_index = None
@@ -697,14 +831,27 @@ class PLCManagerApp:
             messagebox.showwarning("Warning", "No configuration selected for saving.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(self.poll_interval_entry2.get() or POLL_INTERVAL_MS)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
+        # Keep settings that are only edited in the JSON file
         self.error_code_configs[self.selected_error_code_index] = {
+            **self.error_code_configs[self.selected_error_code_index],
             "file_name": self.file_name_entry2.get(),
             "register_type": self.reg_type_combobox2.get(),
             "start_register": int(self.start_reg_entry2.get()),
             "range": int(self.range_entry2.get()),
             "trigger_register_type": self.trigger_type_combobox2.get(),
             "trigger_register": int(self.trigger_entry2.get()),
-            "folder_path": self.error_code_folder_path_entry.get()
+            "folder_path": self.error_code_folder_path_entry.get(),
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry2.get())
         }
 
         self.selected_error_code_index = None
@@ -718,14 +865,27 @@ class PLCManagerApp:
             messagebox.showwarning("Warning", "No configuration selected for saving.")
             return
 
+        # Validate poll_interval_ms is a positive integer
+        try:
+            poll_interval_ms = int(self.poll_interval_entry3.get() or POLL_INTERVAL_MS)
+            if poll_interval_ms <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Poll interval must be a positive integer (milliseconds).")
+            return
+
+        # Keep settings that are only edited in the JSON file
         self.down_time_configs[self.selected_down_time_index] = {
+            **self.down_time_configs[self.selected_down_time_index],
             "file_name": self.file_name_entry3.get(),
             "register_type": self.reg_type_combobox3.get(),
             "start_register": int(self.start_reg_entry3.get()),
             "range": int(self.range_entry3.get()),
             "trigger_register_type": self.trigger_type_combobox3.get(),
             "trigger_register": int(self.trigger_entry3.get()),
-            "folder_path": self.down_time_folder_path_entry.get()
+            "folder_path": self.down_time_folder_path_entry.get(),
+            "poll_interval_ms": poll_interval_ms,
+            "groups": parse_names(self.groups_entry3.get())
         }
 
         self.selected_down_time_index = None
@@ -791,215 +951,97 @@ class PLCManagerApp:
 
     def start_monitoring(self):
         """Start monitoring with clear log updates."""
+        if self.engine is not None and self.engine.is_running():
+            self.update_output_text("Monitoring is already running.")
+            return
         self.monitoring = True
         self.run_button.config(bg="green", fg="white")  # Change the background of Run button to green
         self.stop_button.config(bg="white", fg="black")  # Reset the Stop button appearance
-        self.update_output_text("Monitoring started...")
-        threading.Thread(target=self.real_time_read_registers, daemon=True).start()
+        outputs = monitored_outputs(self.traceability_configs, self.error_code_configs, self.down_time_configs)
+        if self.sink is None:
+            # Captures land in the local spool first, so a slow or offline share never loses them
+            self.sink = CsvSink(self.log_message, latency=self.latency, spool_dir=DEFAULT_SPOOL_DIR)
+        sink = self.sink
+        if self.engine_combobox.get() == "Asyncio":
+            self.update_output_text("Monitoring started (asyncio engine)...")
+            self.engine = AsyncEngine(self.plc_configs, outputs, sink, self.log_message, self.latency)
+        else:
+            self.update_output_text("Monitoring started...")
+            self.engine = ThreadedEngine(self.plc_configs, outputs, sink, self.log_message, self.latency)
+        self.engine.start()
 
     def stop_monitoring(self):
         """Stop monitoring with log update."""
         self.monitoring = False
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
         self.stop_button.config(bg="red", fg="white")  # Change the background of Stop button to red
         self.run_button.config(bg="white", fg="black")  # Reset the Run button appearance
         self.update_output_text("Monitoring stopped.")
 
     def update_output_text(self, message):
-        """
-        Displays only the latest log message in the text widget.
-        Clears the widget before displaying the new message.
-        """
-        # Clear any previous content
-        self.output_text.delete(1.0, tk.END)
-
-        # Insert the new log message
-        self.output_text.insert(tk.END, message)
-
-        # Optional: Force the UI to refresh immediately (helps if multiple updates occur quickly)
-        self.output_text.update_idletasks()
+        """Show a status message in the log text box."""
+        self.log_pipeline.post(message)
 
-    def real_time_read_registers(self):
-        """
-        Continuously monitor all PLC registers in real-time using threading.
-        Write each PLC's register data to a unified CSV file only when:
-            - The trigger register transitions ON (value = 1).
-            - Register data has changed since the last recorded state.
-            - Data is written only once per trigger event.
-        """
-        # Dictionary to track previous states for each PLC
-        previous_register_data = {plc["line_name"]: None for plc in
-                                  self.plc_configs}  # Tracks previous register data per PLC
-        previous_trigger_values = {plc["line_name"]: False for plc in self.plc_configs}  # Tracks trigger status per PLC
-        lock = threading.Lock()  # Lock for thread safety when writing to the CSV file
-
-        def process_registers(plc, output, category):
-            """
-            Continuously monitor registers for a single PLC and write new data to the CSV file only when:
-            - The trigger transitions from OFF to ON.
-            - The register data has changed since the last logged state.
-            """
-            try:
-                # Validate required keys in Output configuration
-                required_keys = ["start_register", "range", "trigger_register", "trigger_register_type"]
-                if not all(key in output for key in required_keys):
-                    self.output_text.insert(
-                        tk.END, f"Invalid Output Configuration for PLC '{plc['line_name']}' in category '{category}'.\n"
-                    )
-                    return
-
-                # Set up Modbus client connection
-                client = ModbusTcpClient(plc["ip_address"], port=plc["port"])
-                if not client.connect():
-                    self.output_text.insert(
-                        tk.END, f"Failed to connect to PLC '{plc['line_name']}' for category '{category}'.\n"
-                    )
-                    return
-
-                # Extract values from Output configuration
-                trigger_register = int(output["trigger_register"])
-                trigger_type = output["trigger_register_type"]
-                start_register = int(output["start_register"])
-                register_range = int(output["range"])
-
-                # Initialize tracking variables specific to this PLC
-                logged_register_data = None  # Stores the last written register data
-                previous_trigger_status = False  # Tracks the trigger's ON/OFF state
-
-                while True:  # Continuous monitoring loop
-                    # Read the trigger register
-                    if trigger_type == "Coil":
-                        trigger_response = client.read_coils(address=trigger_register, count=1)
-                    elif trigger_type == "Discrete":
-                        trigger_response = client.read_discrete_inputs(address=trigger_register, count=1)
-                    elif trigger_type == "Holding":
-                        trigger_response = client.read_holding_registers(address=trigger_register, count=1)
-                    elif trigger_type == "Input":
-                        trigger_response = client.read_input_registers(address=trigger_register, count=1)
-                    else:
-                        self.output_text.insert(
-                            tk.END,
-                            f"Unsupported trigger register type: '{trigger_type}' for PLC '{plc['line_name']}' in category '{category}'.\n"
-                        )
-                        break
-
-                    if trigger_response.isError():
-                        self.output_text.insert(
-                            tk.END,
-                            f"Error reading trigger register for PLC '{plc['line_name']}' in category '{category}'.\n"
-                        )
-                        break
-
-                    # Get the current trigger value
-                    current_trigger_value = trigger_response.bits[0] if trigger_type in ["Coil", "Discrete"] else \
-                        trigger_response.registers[0]
-
-                    # Check if the trigger transitions to ON
-                    if current_trigger_value == 1:
-                        if not previous_trigger_status:  # Transition from OFF to ON detected
-                            # Read register data only if the trigger register is ON
-                            register_response = client.read_holding_registers(address=start_register,
-                                                                              count=register_range)
-                            if register_response.isError() or not register_response.registers:
-                                self.output_text.insert(
-                                    tk.END,
-                                    f"Error reading registers for PLC '{plc['line_name']}' in category '{category}'.\n"
-                                )
-                                break
-
-                            current_registers = register_response.registers
-
-                            # Write to CSV **only if data has changed** since the last logged state
-                            with lock:  # Ensure thread-safe access to shared resources
-                                if current_registers != logged_register_data:
-                                    self.log_to_csv(output, plc, current_registers, category)  # Write data to CSV
-                                    logged_register_data = current_registers  # Update the last logged data
-
-                            previous_trigger_status = True  # Update trigger status to ON
-
-                    elif previous_trigger_status:  # Transition back to OFF
-                        previous_trigger_status = False  # Reset trigger status
-
-                    time.sleep(0.1)  # Adjust polling interval
-
-            except Exception as e:
-                self.output_text.insert(
-                    tk.END, f"Error in monitoring for PLC '{plc['line_name']}' in category '{category}': {e}\n"
-                )
-            finally:
-                if client.is_socket_open():
-                    client.close()
-
-        # Spawn threads for each PLC and Configuration
-        threads = []
-        for plc in self.plc_configs:
-            for config_type, configs in [("Traceability", self.traceability_configs),
-                                         ("ErrorCodes", self.error_code_configs),
-                                         ("DownTime", self.down_time_configs)]:
-                if configs:
-                    for config in configs:
-                        thread = threading.Thread(target=process_registers, args=(plc, config, config_type))
-                        thread.daemon = True
-                        thread.start()
-                        threads.append(thread)
-
-    def log_to_csv(self, output, plc, register_data, category):
+    def log_message(self, message):
         """
-        Write register data row by row into a unified CSV file for all PLCs.
+        Receive a message from the monitoring engine.
+        Called from worker threads, so it only queues the message for refresh_output_text.
         """
-        output_folder = output.get("folder_path", "")
-        file_name = output.get("file_name", "")
-        if not output_folder or not file_name:
-            self.output_text.insert(
-                tk.END,
-                f"No valid folder path or file name configured for PLC '{plc['line_name']}' in category '{category}'.\n"
-            )
-            return
-
-        # Unified CSV file name for all PLCs
-        file_date = datetime.now().strftime("%Y-%m-%d")
-        csv_file_name = os.path.join(output_folder, f"{file_name}_{file_date}.csv")
-
-        # Ensure the output folder exists
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-
-        # Prepare data row for this PLC
-        timestamp_data = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        row = {
-            "Line Name": plc["line_name"],
-            "Equipment Name": plc["equipment_name"],
-            "IP Address": plc["ip_address"],
-            "Timestamp": timestamp_data,
-        }
-
-        # Append register data as additional columns
-        row.update({
-            f"Register_{i + 1}": value for i, value in enumerate(register_data)
-        })
-
-        # Prepare headers dynamically for registers
-        headers = ["Line Name", "Equipment Name", "IP Address", "Timestamp"] + [f"Register_{i + 1}" for i in range(len(register_data))]
+        self.log_pipeline.post(message)
+
+    def refresh_output_text(self):
+        """Show the recent log lines; runs periodically on the Tk main loop."""
+        if self.log_pipeline.drain():
+            self.output_text.delete(1.0, tk.END)
+            self.output_text.insert(tk.END, self.log_pipeline.text())
+            self.output_text.see(tk.END)
+        self.root.after(LOG_REFRESH_MS, self.refresh_output_text)
+
+    def show_latency(self):
+        """Show the trigger-to-capture latency histograms per PLC and output in a separate window."""
+        window = tk.Toplevel(self.root)
+        window.title("Trigger-to-Capture Latency")
+
+        columns = ("line", "file", "stage", "count", "p50", "p99", "max")
+        table = ttk.Treeview(window, columns=columns, show="headings", height=15)
+        for column, heading, width in [("line", "Line Name", 100), ("file", "File Name", 100), ("stage", "Stage", 120),
+                                       ("count", "Count", 60), ("p50", "p50 (ms)", 70), ("p99", "p99 (ms)", 70),
+                                       ("max", "Max (ms)", 70)]:
+            table.heading(column, text=heading)
+            table.column(column, width=width, anchor="e" if column in ("count", "p50", "p99", "max") else "w")
+        table.pack(padx=10, pady=10, fill="both", expand=True)
+
+        def refresh():
+            table.delete(*table.get_children())
+            for line_name, file_name, stage, summary in self.latency.summaries():
+                table.insert("", tk.END, values=(line_name, file_name, stage, summary["count"],
+                                                 f"{summary['p50_ms']:.1f}", f"{summary['p99_ms']:.1f}",
+                                                 f"{summary['max_ms']:.1f}"))
+
+        def dump():
+            path = filedialog.asksaveasfilename(title="Save Latency Histograms", defaultextension=".json",
+                                                filetypes=[("JSON", "*.json")])
+            if path:
+                self.latency.dump(path)
+                messagebox.showinfo("Info", f"Latency histograms saved to {path}.")
+
+        ttk.Button(window, text="Refresh", command=refresh).pack(side="left", padx=10, pady=10)
+        ttk.Button(window, text="Save...", command=dump).pack(side="left", padx=10, pady=10)
+        refresh()
 
-        # Write the data to the CSV file
-        try:
-            with open(csv_file_name, "a", newline="") as csv_file:
-                csv_writer = csv.DictWriter(csv_file, fieldnames=headers)
-                if csv_file.tell() == 0:  # Write headers only if file is empty/new
-                    csv_writer.writeheader()
-                csv_writer.writerow(row)
-                self.output_text.insert(
-                    tk.END, f"Written data for PLC '{plc['line_name']}' to {csv_file_name}.\n"
-                )
-        except Exception as e:
-            self.output_text.insert(
-                tk.END, f"Error writing to {csv_file_name} for PLC '{plc['line_name']}' in category '{category}': {e}\n"
-            )
     def on_close(self):
         """
         Handle the app window close event.
         Stop monitoring and save all configurations.
         """
         self.monitoring = False  # Ensure monitoring stops
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+        if self.sink is not None:
+            self.sink.close()  # Write the rows still queued for the CSV files
         self.save_all_configs()  # Save configurations to JSON files
         self.root.destroy()  # Close the application window
 